@@ -1,16 +1,42 @@
-from dataclasses import dataclass
+import base64
 import json
-from typing import List, Dict
-
-from pprint import pprint
+import math
+import re
+import time
+from http import HTTPStatus
+from typing import List, Dict, NamedTuple, Tuple
 
 from enum import Enum
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 
+import urllib3
+
+# orjson is considerably faster than the standard library at both encoding and
+# decoding, which matters for large payloads like the output of `zfs get all`.
+# It is optional; we fall back to the standard library if it is not installed.
+# Either way _dumps returns bytes.
+try:
+    import orjson
+
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
 
+    def _dumps(obj) -> bytes:
+        # Hand requests bytes like orjson does, so it does not have to encode
+        # the body again. Escaping keeps the output ASCII and the separators
+        # match the compact form orjson produces.
+        return json.dumps(obj, separators=(",", ":")).encode("ascii")
+
+    _loads = json.loads
+
+LOGIN_ENDPOINT = "/login"
 ZFS_DATASET_ENDPOINT = "/internal/v1/zfs/dataset"
 ZFS_DATASET_DESTROY_ENDPOINT = "/internal/v1/dataset/destroy"
 ZFS_DATASET_PERMS_ENDPOINT = "/internal/v1/fs/perms"
@@ -20,6 +46,29 @@ SHELL_RUN_ENDPOINT = "/internal/v1/shell/run"
 ZFS_CMD = "/usr/sbin/zfs"
 BSRZFS_CMD = "/usr/racktop/sbin/bsrzfs"
 API_TIMEOUT = 60
+API_POOL_MAXSIZE = 16
+API_DESTROY_WORKERS = 8
+API_PERMS_WORKERS = 8
+API_CLIENT_WORKERS = 4
+# Tokens are renewed this many seconds ahead of their actual expiry, so that a
+# request does not race the expiration on its way to the API.
+TOKEN_EXPIRY_MARGIN = 30
+# How long, in seconds, we trust a previous answer about whether a dataset
+# exists before asking the API again.
+EXISTS_CACHE_TTL = 30
+# Same, for properties of a dataset.
+PROPS_CACHE_TTL = 30
+# Retries of requests which failed with a transient gateway error, only for
+# methods which are safe to repeat. See the Retry set up in the client.
+API_RETRIES = 3
+# Only queries may be repeated; POSTs run commands and create datasets, which
+# must not happen twice because a response got lost.
+_RETRY_METHODS = frozenset(("GET", "HEAD"))
+
+# Plain ints, so that comparing against a status code is as cheap as it can be.
+_STATUS_OK = HTTPStatus.OK.value
+_STATUS_UNAUTHORIZED = HTTPStatus.UNAUTHORIZED.value
+_STATUS_ISE = HTTPStatus.INTERNAL_SERVER_ERROR.value
 
 # READ_ONLY_PROPS = (
 #     "casesensitivity",
@@ -42,48 +91,61 @@ API_TIMEOUT = 60
 #     "special_small_blocks",
 # )
 
-KNOWN_PROPS = (
-    "aclinherit",
-    "aclmode",
-    "atime",
-    "canmount",
-    "checksum",
-    "compression",
-    "copies",
-    "devices",
-    "exec",
-    "filesystem_limit",
-    "logbias",
-    "nbmand",
-    "casesensitivity",
-    "normalization",
-    "utf8only",
-    "primarycache",
-    "quota",
-    "readonly",
-    "recordsize",
-    "redundant_metadata",
-    "refquota",
-    "refreservation",
-    "reservation",
-    "secondarycache",
-    "setuid",
-    "snapdir",
-    "snapshot_limit",
-    "sync",
-    "vscan",
-    "xattr",
-    "zoned",
-    "racktop:storage_profile",
-    "racktop:encoded_description",
-    "smartfolders",
-    "racktop:ub",
-    "racktop:ub_suspend",
-    "racktop:ub_thresholds",
-    "racktop:ub_trial",
-    "racktop:version",
-    "sharenfs",
-    "sharesmb",
+# Membership checks happen once per line of `zfs get` output and once per
+# property in a Dataset, so these are kept as frozensets.
+KNOWN_PROPS = frozenset(
+    (
+        "aclinherit",
+        "aclmode",
+        "atime",
+        "canmount",
+        "checksum",
+        "compression",
+        "copies",
+        "devices",
+        "exec",
+        "filesystem_limit",
+        "logbias",
+        "nbmand",
+        "casesensitivity",
+        "normalization",
+        "utf8only",
+        "primarycache",
+        "quota",
+        "readonly",
+        "recordsize",
+        "redundant_metadata",
+        "refquota",
+        "refreservation",
+        "reservation",
+        "secondarycache",
+        "setuid",
+        "snapdir",
+        "snapshot_limit",
+        "sync",
+        "vscan",
+        "xattr",
+        "zoned",
+        "racktop:storage_profile",
+        "racktop:encoded_description",
+        "smartfolders",
+        "racktop:ub",
+        "racktop:ub_suspend",
+        "racktop:ub_thresholds",
+        "racktop:ub_trial",
+        "racktop:version",
+        "sharenfs",
+        "sharesmb",
+    )
+)
+
+_NULLABLE_SIZE_PROPS = frozenset(
+    (
+        "quota",
+        "refquota",
+        "reservation",
+        "refreservation",
+    )
 )
 
 
@@ -114,9 +176,9 @@ class BsrApiPermsRespose:
                 self._owner_group_sid = self._task.get("OwnerGroupSid")
                 self._owner_sid = self._task.get("OwnerSid")
         else:
-            self._error_code = self._data["Code"]
-            if "Dataset not found" in self._data["Message"]:
-                self._error_code = DatasetErrors.DoesNotExist
+            self._error_code = (
+                _classify_error(self._data["Message"]) or self._data["Code"]
+            )
 
     @property
     def failed(self):
@@ -163,29 +225,21 @@ class BsrApiPermsRespose:
 
 
 class BsrApiCommandResponse:
+    # One of these is created for every shell command we run through the API,
+    # so we keep instances small and attribute access cheap.
+    __slots__ = ("result", "error_code", "stdout", "stderr")
+
     def __init__(self, resp_obj):
         self.result: dict = resp_obj.get("Result", {})
         if not self.result:
             raise EmptyRespObject("Cannot handle an empty API response")
-        self._error_code = self.result.get("ExitCode", "-1")
-        self._stdout = self.result.get("StdOut")
-        self._stderr = self.result.get("StdErr")
+        self.error_code = self.result.get("ExitCode", -1)
+        self.stdout = self.result.get("StdOut")
+        self.stderr = self.result.get("StdErr")
 
     @property
     def failed(self):
-        return self._error_code != 0
-
-    @property
-    def error_code(self):
-        return self._error_code
-
-    @property
-    def stdout(self):
-        return self._stdout
-
-    @property
-    def stderr(self):
-        return self._stderr
+        return self.error_code != 0
 
 
 class DatasetErrors(Enum):
@@ -196,18 +250,49 @@ class DatasetErrors(Enum):
     DoesNotHaveEnoughSpace = 1030
 
 
+# Well known failure modes reported by zfs and bsrzfs on stderr, or by the API
+# itself in error messages. Each group in the pattern corresponds to an entry
+# in _KNOWN_ERRORS, which lets us classify an error with a single scan of the
+# message.
+_KNOWN_ERRORS_RE = re.compile(
+    r"(dataset does not exist|Dataset not found)"
+    r"|(size is greater than available space|out of space)"
+    r"|(dataset already exists)"
+)
+_KNOWN_ERRORS = (
+    None,
+    DatasetErrors.DoesNotExist,
+    DatasetErrors.DoesNotHaveEnoughSpace,
+    DatasetErrors.Exists,
+)
+
+
+def _classify_error(message: str):
+    """Maps the stderr of a failed command, or an error message from the API, to
+    one of the known dataset errors.
+
+    Args:
+        message (str): Standard error output of the failed command or API error message.
+
+    Returns:
+        DatasetErrors: Matching error, or None if the failure is not a known one.
+    """
+    m = _KNOWN_ERRORS_RE.search(message or "")
+    if m is None:
+        return None
+    return _KNOWN_ERRORS[m.lastindex]
+
+
 @contextmanager
 def suppress_insecure_https_warnings():
     import warnings
-    import urllib3
 
     with warnings.catch_warnings():
         urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
         yield None
 
 
-@dataclass
-class ApiCreds:
+class ApiCreds(NamedTuple):
     u: str
     p: str
 
@@ -224,6 +309,51 @@ class LoginError(Exception):
     pass
 
 
+def _token_expiry(token: str):
+    """Extracts expiry time from the claims of a JWT without verifying it.
+
+    Args:
+        token (str): Token returned by the login endpoint.
+
+    Returns:
+        float: Expiry as seconds since the epoch, or None if the token does not look like a JWT with an exp claim.
+    """
+    try:
+        claims = token.split(".")[1]
+        # JWTs strip base64 padding, which the decoder insists on having.
+        claims += "=" * (-len(claims) % 4)
+        return float(_loads(base64.urlsafe_b64decode(claims))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _build_set_args(pairs, ds_path: str) -> str:
+    """Builds arguments for a zfs set command.
+
+    Args:
+        pairs (Iterable[Tuple[str, Any]]): Property names and values to set.
+        ds_path (str): Dataset on which properties are set.
+
+    Returns:
+        str: Arguments in the form of "set <prop>=<value> ... <dataset>".
+    """
+    return "set " + " ".join(f"{k}={v}" for k, v in pairs) + " " + ds_path
+
+
+def _drop_subtree(cache: Dict, ds_path: str):
+    """Removes entries for a dataset and all of its descendants from a cache
+    keyed by dataset path.
+
+    Args:
+        cache (Dict): Cache to remove entries from.
+        ds_path (str): Path to the top-most dataset to remove.
+    """
+    prefix = ds_path + "/"
+    for path in list(cache):
+        if path == ds_path or path.startswith(prefix):
+            cache.pop(path, None)
+
+
 class DatasetQueryError(Exception):
     def __init__(self, error_code: int, error_type: str, *args: object) -> None:
         self.error_code = error_code
@@ -243,66 +373,215 @@ class AnsibleBsrApiClient:
         port=8443,
         timeout=API_TIMEOUT,
         verify=False,
+        http=None,
+        pool_maxsize=API_POOL_MAXSIZE,
     ) -> None:
         self.cr = cr
         self.host = host
         self.port = port
         self.token = None
+        self._token_exp = math.inf
         self.timeout = timeout
         self.verify = verify
         self.api_conn_err = None
+        self._pool_maxsize = pool_maxsize
+        self._executor = None
+        self._exists_cache: Dict[str, Tuple[float, bool]] = {}
+        self._props_cache: Dict[str, Tuple[float, Dict]] = {}
+        # Endpoints never change for the lifetime of the client, so we build
+        # their URLs once rather than on every request.
+        self._url_login = self.url(LOGIN_ENDPOINT)
+        self._url_shell = self.url(SHELL_RUN_ENDPOINT)
+        self._url_dataset = self.url(ZFS_DATASET_ENDPOINT)
+        self._url_destroy = self.url(ZFS_DATASET_DESTROY_ENDPOINT)
+        self._url_perms = self.url(ZFS_DATASET_PERMS_ENDPOINT)
+        self._url_perms_apply = self.url(ZFS_DATASET_PERMS_APPLY_ENDPOINT)
+        self._headers = {
+            "Content-Type": "application/json",
+            "User-Agent": "BsrCli",  # This is why we cannot have nice things :)
+        }
+        # All requests made by this client go through a single session, which
+        # lets us reuse the keep-alive connection to the API instead of paying
+        # for a new TCP and TLS handshake on every call. A Session-compatible
+        # object may be passed in instead, e.g. to mock out the API in tests.
+        # The pool should be at least as large as the number of requests we
+        # expect to have in flight at once.
+        self._owns_session = http is None
+        # Headers passed with every request; only needed for a session which
+        # was passed in, our own session carries them itself.
+        self._request_headers = None
+        if http is None:
+            http = requests.Session()
+            http.mount(
+                "https://",
+                HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=pool_maxsize,
+                    # Only gateway errors are retried. Failing to connect or
+                    # timing out waiting for a response is reported straight
+                    # away, as it always was, rather than after several
+                    # timeouts. When retries run out, the last response is
+                    # returned to be handled like any other failed response.
+                    max_retries=Retry(
+                        total=API_RETRIES,
+                        connect=0,
+                        read=0,
+                        backoff_factor=0.2,
+                        status_forcelist=(502, 503, 504),
+                        allowed_methods=_RETRY_METHODS,
+                        raise_on_status=False,
+                    ),
+                ),
+            )
+            http.verify = verify
+            http.headers.update(self._headers)
+        else:
+            # The session belongs to the caller, so it is left as it is. Every
+            # request already says whether to verify certificates.
+            self._request_headers = self._headers
+        self._session = http
+        if not verify:
+            # The API normally has a self-signed certificate, which would
+            # otherwise trigger a warning on every request. Warning filters
+            # are process-wide, so this only has to happen once and not
+            # around every call.
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Releases pooled connections and worker threads held by this client.
+        A session which was passed in is left open for its owner to close.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._owns_session:
+            self._session.close()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """Executor shared by callers of this client, letting them issue
+        independent requests concurrently over the pooled session. It is
+        created the first time it is needed.
+
+        Returns:
+            ThreadPoolExecutor: Executor owned by this client.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=min(API_CLIENT_WORKERS, self._pool_maxsize)
+            )
+        return self._executor
 
     def url(self, route):
         return f"https://{self.host}:{self.port}/{route.lstrip('/')}"
 
-    @property
-    def _headers(self):
-        return {
-            "Authorization": f"Bearer {self.token}",
-            "Content-Type": "application/json",
-            "User-Agent": "BsrCli",  # This is why we cannot have nice things :)
-        }
+    def _parse(self, resp: requests.Response):
+        """Decodes the JSON body of a response. This works off the raw bytes,
+        which saves decoding the whole body into a str first as resp.json()
+        would.
+
+        Args:
+            resp (requests.Response): Response from the API.
+
+        Returns:
+            Any: Body of the response converted into a native type.
+        """
+        return _loads(resp.content)
 
     def _login(self, username: str, passwd: str):
-        with suppress_insecure_https_warnings():
-            try:
-                resp = requests.post(
-                    self.url("/login"),
-                    auth=(username, passwd),
-                    verify=self.verify,
-                    timeout=self.timeout,
-                )
-                if resp.status_code == 200:
-                    token_obj = resp.json()
-                    if not token_obj["token"]:
-                        raise LoginError("Token value cannot be an empty string")
-                    return token_obj["token"]
-                raise LoginError(resp.content.__str__())
-            # This will happen if we cannot connect to the API, which may or
-            # may not be bsrapid.
-            except requests.exceptions.ConnectTimeout as err:
-                self.api_conn_err = err
-                return None
+        try:
+            resp = self._session.post(
+                self._url_login,
+                auth=(username, passwd),
+                headers=self._request_headers,
+                verify=self.verify,
+                timeout=self.timeout,
+            )
+            if resp.status_code == _STATUS_OK:
+                token_obj = self._parse(resp)
+                if not token_obj["token"]:
+                    raise LoginError("Token value cannot be an empty string")
+                return token_obj["token"]
+            raise LoginError(resp.content.__str__())
+        # This will happen if we cannot connect to the API, which may or
+        # may not be bsrapid.
+        except requests.exceptions.ConnectTimeout as err:
+            self.api_conn_err = err
+            return None
 
     def login(self):
         self.token = self._login(self.cr.user, self.cr.passwd)
+        # Tokens we could not decode an expiry from are assumed to be good
+        # until the API tells us otherwise with a 401.
+        self._token_exp = math.inf
+        if self.token:
+            exp = _token_expiry(self.token)
+            if exp is not None:
+                self._token_exp = exp - TOKEN_EXPIRY_MARGIN
+        # The rest of our headers are already in place, only the token
+        # changes when we log in again.
+        self._headers["Authorization"] = f"Bearer {self.token}"
+        if self._owns_session:
+            self._session.headers["Authorization"] = self._headers["Authorization"]
+
+    def _token_expired(self) -> bool:
+        return time.time() >= self._token_exp
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Sends a request to the API, logging in first if we do not have a usable
+        token yet. If the API rejects our token anyway, we log in again and replay
+        the request once.
+
+        Args:
+            method (str): HTTP method, i.e. GET or POST.
+            url (str): Full URL of the endpoint.
+
+        Returns:
+            requests.Response: Response from the API.
+
+        Raises:
+            DatasetQueryError: Raised if we are unable to connect to the API to login.
+        """
+        # This is the same check as in auth_if_required, inlined since it
+        # happens on every request and is almost always false.
+        if not self.token or time.time() >= self._token_exp:
+            self._auth()
+        if self._request_headers is not None:
+            kwargs["headers"] = self._request_headers
+        resp = self._session.request(method, url, **kwargs)
+        if resp.status_code == _STATUS_UNAUTHORIZED:
+            # The token may have been revoked or may have expired earlier
+            # than it claimed it would. A streamed response has to give its
+            # connection back to the pool before we try again.
+            resp.close()
+            self._auth()
+            resp = self._session.request(method, url, **kwargs)
+        return resp
 
     def auth_if_required(self):
-        # There should eventually be a check here to make sure that token is
-        # not expired. We may have our token, but it may not be usable any
-        # longer.
-        if not self.token:
-            self.login()
-            if self.api_conn_err is not None:
-                raise DatasetQueryError(
-                    DatasetErrors.ConnectionTimeout,
-                    "API Connection Error",
-                    self.api_conn_err.args[0],
-                )
+        # We may have a token, but it may not be usable any longer, in which
+        # case we proactively get a new one.
+        if not self.token or self._token_expired():
+            self._auth()
         return True
 
+    def _auth(self):
+        self.login()
+        if self.api_conn_err is not None:
+            raise DatasetQueryError(
+                DatasetErrors.ConnectionTimeout,
+                "API Connection Error",
+                self.api_conn_err.args[0],
+            )
+
     # def post_shell_command(
-    #     self, cmd: str, args: str = "", use_shell=True, is_query=True, requests=requests
+    #     self, cmd: str, args: str = "", use_shell=True, is_query=True
     # ) -> Dict:
     #     """Sends a command POST request to API. This may or may not be a
     #     mutating command.
@@ -310,7 +589,6 @@ class AnsibleBsrApiClient:
     #     Args:
     #         cmd (str): Command to execute on the appliance.
     #         args (str, optional): Arguments which the command will accept. Defaults to "".
-    #         requests (_type_, optional): Allows injection of custom requests implementation. Defaults to requests.
 
     #     Returns:
     #         dict: Response object from the API call, converted into a dict.
@@ -325,40 +603,41 @@ class AnsibleBsrApiClient:
     #         "OperationOptions": {"ClientTxId": ""},
     #     }
 
-    #     with suppress_insecure_https_warnings():
-    #         resp = requests.post(
-    #             self.url(SHELL_RUN_ENDPOINT),
-    #             headers=self._headers,
-    #             data=json.dumps(cmd_data),
-    #             verify=self.verify,
-    #         )
-    #     return resp.json()
+    #     resp = self._session.post(
+    #         self._url_shell,
+    #         data=_dumps(cmd_data),
+    #         verify=self.verify,
+    #     )
+    #     return self._parse(resp)
 
     def _parse_dataset_details(self, props_str: str):
         props = dict()
+        known = KNOWN_PROPS
+        nullable = _NULLABLE_SIZE_PROPS
         # API gives us a single string that we have to manipulate into a native
-        # data structure. We parse the string, splitting it into a list of lines and
-        # then handle each line which is a single prop.
-        lines = props_str.split("\n")
-        for line in lines:
-            _, prop, value, _ = line.split("\t")
-            if prop not in KNOWN_PROPS:
+        # data structure. Each line is a single prop in the form of
+        # "<dataset>\t<prop>\t<value>\t<source>". We only need the two middle
+        # fields, so we do not bother splitting the source off.
+        # Matching the lines with a compiled regex, or peeling fields off with
+        # str.partition, were both measured to be slower than this loop, since
+        # each line is short and a bounded str.split is a single C call.
+        for line in props_str.splitlines():
+            parts = line.split("\t", 3)
+            if len(parts) < 3:
+                continue
+            prop = parts[1]
+            value = parts[2]
+            if prop not in known:
                 continue
             elif value == "none":
                 props[prop] = None
-            elif value.isnumeric():
-                # FIXME: This needs to be checked in terms of speed. It seems
-                # like it may be slower to check membership.
-                if prop in (
-                    "quota",
-                    "refquota",
-                    "reservation",
-                    "refreservation",
-                ):
-                    if value == "0":
-                        props[prop] = None
-                    else:
-                        props[prop] = value
+            # Most values are words like "on" or "lz4", which the range check
+            # on the first character rejects without a Unicode lookup.
+            elif "0" <= value[:1] <= "9" and value.isdigit():
+                # Size limits and reservations of 0 mean there is no limit or
+                # reservation set, which we represent the same way as "none".
+                if prop in nullable:
+                    props[prop] = None if value == "0" else value
                 else:
                     props[prop] = int(value)
             else:
@@ -366,44 +645,69 @@ class AnsibleBsrApiClient:
         return props
 
     def get_dataset_properties(self, ds_path: str):
+        # Tasks commonly read properties of a dataset more than once, around
+        # changes made to it. Changing properties through this client
+        # invalidates what we know about the dataset, so the copy we keep
+        # stays accurate. Callers get their own dict to work with.
+        cached = self._props_cache.get(ds_path)
+        if cached is not None and time.monotonic() < cached[0]:
+            return dict(cached[1])
         cmd = {
             "Command": ZFS_CMD,
             "Args": f"get -Hp -t filesystem,volume all {ds_path}",
         }
-        with suppress_insecure_https_warnings():
-            self.auth_if_required()
-            resp = requests.post(
-                self.url(SHELL_RUN_ENDPOINT),
-                headers=self._headers,
-                data=json.dumps(cmd),
-                verify=self.verify,
-                timeout=self.timeout,
-            )
-            result = BsrApiCommandResponse(resp.json())
-            if result.failed:
-                if "dataset does not exist" in result.stderr:
-                    raise DatasetQueryError(
-                        DatasetErrors.DoesNotExist, None, result.stderr
-                    )
-                raise DatasetQueryError(result.error_code, None, result.stderr)
-        return self._parse_dataset_details(result.stdout)
+        resp = self._send(
+            "POST",
+            self._url_shell,
+            data=_dumps(cmd),
+            verify=self.verify,
+            timeout=self.timeout,
+        )
+        result = BsrApiCommandResponse(self._parse(resp))
+        self._raise_command_failure(result)
+        props = self._parse_dataset_details(result.stdout)
+        expires = time.monotonic() + PROPS_CACHE_TTL
+        self._props_cache[ds_path] = (expires, props)
+        # Having gotten its properties also tells us the dataset exists.
+        self._remember_exists(ds_path, True)
+        return dict(props)
 
     def _raise_command_failure(self, result: BsrApiCommandResponse):
         if result.failed:
-            if (
-                "size is greater than available space" in result.stderr
-                or "out of space" in result.stderr
-            ):
-                raise DatasetQueryError(
-                    DatasetErrors.DoesNotHaveEnoughSpace, None, result.stderr
-                )
-            elif "dataset already exists" in result.stderr:
-                raise DatasetQueryError(DatasetErrors.Exists, None, result.stderr)
-            raise DatasetQueryError(result.error_code, None, result.stderr)
+            # Well known failures get a more specific error code, anything
+            # else is reported with the exit code of the command.
+            error_code = _classify_error(result.stderr) or result.error_code
+            raise DatasetQueryError(error_code, None, result.stderr)
         return result
 
-    def create_dataset(self, ds_path: str, requests=requests, **props):
-        args = f'create {" ".join([f"-o {k}={v}" for k, v in props.items()])} {ds_path}'
+    def _forget_dataset(self, ds_path: str):
+        """Drops anything we remember about a dataset and its descendants. Must be
+        called before any operation which creates or destroys datasets.
+
+        Args:
+            ds_path (str): Path to dataset that is about to change.
+        """
+        _drop_subtree(self._exists_cache, ds_path)
+        _drop_subtree(self._props_cache, ds_path)
+
+    def _forget_props(self, ds_path: str):
+        """Drops properties we remember for a dataset and its descendants, which
+        may inherit them. Must be called before any operation which sets
+        properties on a dataset.
+
+        Args:
+            ds_path (str): Path to dataset that is about to change.
+        """
+        _drop_subtree(self._props_cache, ds_path)
+
+    def _remember_exists(self, ds_path: str, exists: bool) -> bool:
+        self._exists_cache[ds_path] = (time.monotonic() + EXISTS_CACHE_TTL, exists)
+        return exists
+
+    def create_dataset(self, ds_path: str, **props):
+        self._forget_dataset(ds_path)
+        opts = " ".join(f"-o {k}={v}" for k, v in props.items())
+        args = f"create {opts} {ds_path}"
 
         data = {
             "Command": BSRZFS_CMD,
@@ -411,26 +715,21 @@ class AnsibleBsrApiClient:
             "UseShell": False,
             "IsQuery": False,
         }
-        with suppress_insecure_https_warnings():
-            self.auth_if_required()
-            resp = requests.post(
-                self.url(SHELL_RUN_ENDPOINT),
-                headers=self._headers,
-                data=json.dumps(data),
-                verify=self.verify,
-                timeout=self.timeout,
-            )
-            result = BsrApiCommandResponse(resp.json())
-            return self._raise_command_failure(result)
-
-    def set_dataset_properties(
-        self, ds_path: str, requests=requests, **props
-    ) -> BsrApiCommandResponse:
+        resp = self._send(
+            "POST",
+            self._url_shell,
+            data=_dumps(data),
+            verify=self.verify,
+            timeout=self.timeout,
+        )
+        result = BsrApiCommandResponse(self._parse(resp))
+        return self._raise_command_failure(result)
+
+    def set_dataset_properties(self, ds_path: str, **props) -> BsrApiCommandResponse:
         """Sets dataset properties.
 
         Args:
             ds_path (str): Properties are set on this dataset.
-            requests (_type_, optional): Allows injection of custom requests implementation. Defaults to requests.
 
         Raises:
             DatasetQueryError: An exception with some information about what failed.
@@ -441,7 +740,8 @@ class AnsibleBsrApiClient:
         """
         if not props:
             raise ValueError("properties argument cannot be an empty dictionary")
-        args = f'set {" ".join([f"{k}={v}" for k, v in props.items()])} {ds_path}'
+        self._forget_props(ds_path)
+        args = _build_set_args(props.items(), ds_path)
 
         data = {
             "Command": ZFS_CMD,
@@ -449,50 +749,82 @@ class AnsibleBsrApiClient:
             "UseShell": False,
             "IsQuery": False,
         }
-        with suppress_insecure_https_warnings():
-            self.auth_if_required()
-            resp = requests.post(
-                self.url(SHELL_RUN_ENDPOINT),
-                headers=self._headers,
-                data=json.dumps(data),
-                verify=self.verify,
-                timeout=self.timeout,
-            )
-            result = BsrApiCommandResponse(resp.json())
-            self._raise_command_failure(result)
-            return result
-
-    def get_dataset_perms(self, ds_path: str, requests=requests) -> BsrApiPermsRespose:
-        with suppress_insecure_https_warnings():
-            self.auth_if_required()
-            resp = requests.get(
-                self.url(ZFS_DATASET_PERMS_ENDPOINT),
-                headers=self._headers,
-                params={
-                    "dataset": ds_path,
-                    "recursive": True,
-                    "resolve_identities": True,
-                },
-                verify=self.verify,
-                timeout=self.timeout,
-            )
-            result = BsrApiPermsRespose(resp.json(), failed=resp.status_code != 200)
-            if result.failed:
-                # Dataset not existing is a common scenario, but we
-                # unfortunately do not get a 404 in this scenario. We get a 500
-                # instead. A bit of tweaking happens in the __init__ of
-                # BsrApiPermsResponse letting us alter our message in the case
-                # this is a well known failure mode.
-                if result.error_code == DatasetErrors.DoesNotExist:
-                    raise DatasetQueryError(
-                        result.error_code,
-                        result.error_type,
-                        f"unable to obtain ACL because dataset {ds_path} does not appear to exist",
-                    )
+        resp = self._send(
+            "POST",
+            self._url_shell,
+            data=_dumps(data),
+            verify=self.verify,
+            timeout=self.timeout,
+        )
+        result = BsrApiCommandResponse(self._parse(resp))
+        self._raise_command_failure(result)
+        return result
+
+    def reconcile_dataset_properties(self, ds_path: str, **desired) -> Dict:
+        """Sets dataset properties and reports properties from before and after
+        the change. Whether the dataset exists is learned from the first lookup
+        of properties, rather than from a separate existence check. Nothing is
+        written if the dataset already has the desired values.
+
+        Args:
+            ds_path (str): Properties are set on this dataset.
+
+        Raises:
+            DatasetQueryError: An exception with some information about what failed.
+            ValueError: Raised when desired is an empty dictionary.
+
+        Returns:
+            Dict: Whether the dataset existed, with properties before and after the change under "before" and "after". Both are None if the dataset does not exist.
+        """
+        try:
+            before = self.get_dataset_properties(ds_path)
+        except DatasetQueryError as err:
+            if err.error_code == DatasetErrors.DoesNotExist:
+                return {"existed": False, "before": None, "after": None}
+            raise
+        # Re-applying properties which are already set, e.g. disabling a share
+        # which is already off, would cost a write and another lookup.
+        if all(k in before and before[k] == v for k, v in desired.items()):
+            return {"existed": True, "before": before, "after": before}
+        self.set_dataset_properties(ds_path, **desired)
+        after = self.get_dataset_properties(ds_path)
+        return {"existed": True, "before": before, "after": after}
+
+    def get_dataset_perms(self, ds_path: str) -> BsrApiPermsRespose:
+        # Recursive ACLs of a large tree make for a big response. We read the
+        # body off the connection ourselves and parse the bytes directly,
+        # rather than having requests assemble resp.content out of chunks.
+        with self._send(
+            "GET",
+            self._url_perms,
+            params={
+                "dataset": ds_path,
+                "recursive": True,
+                "resolve_identities": True,
+            },
+            verify=self.verify,
+            timeout=self.timeout,
+            stream=True,
+        ) as resp:
+            body = resp.raw.read(decode_content=True)
+            failed = resp.status_code != _STATUS_OK
+        result = BsrApiPermsRespose(_loads(body), failed=failed)
+        if result.failed:
+            # Dataset not existing is a common scenario, but we
+            # unfortunately do not get a 404 in this scenario. We get a 500
+            # instead. A bit of tweaking happens in the __init__ of
+            # BsrApiPermsResponse letting us alter our message in the case
+            # this is a well known failure mode.
+            if result.error_code == DatasetErrors.DoesNotExist:
                 raise DatasetQueryError(
-                    result.error_code, result.error_type, result.error_message
+                    result.error_code,
+                    result.error_type,
+                    f"unable to obtain ACL because dataset {ds_path} does not appear to exist",
                 )
-            return result
+            raise DatasetQueryError(
+                result.error_code, result.error_type, result.error_message
+            )
+        return result
 
     def set_dataset_perms(
         self,
@@ -501,7 +833,6 @@ class AnsibleBsrApiClient:
         owner_sid: str,
         owner_group_sid: str,
         recursive=False,
-        requests=requests,
     ) -> BsrApiPermsRespose:
         """Modifies ACL and sets User SID and Group SID on the given dataset.
 
@@ -511,7 +842,6 @@ class AnsibleBsrApiClient:
             owner_sid (str): SID of the user who owns this dataset.
             owner_group_sid (str): Group SID of the group owner of this dataset.
             recursive (bool, optional): Whether or not this change should be applied recursively. Defaults to False.
-            requests (_type_, optional): Allows injection of custom requests implementation. Defaults to requests.
 
         Raises:
             DatasetQueryError: An exception with some information about what failed.
@@ -536,23 +866,54 @@ class AnsibleBsrApiClient:
             "WaitUntilComplete": False,
             "ClientTxId": None,
         }
-        with suppress_insecure_https_warnings():
-            self.auth_if_required()
-            resp = requests.post(
-                self.url(ZFS_DATASET_PERMS_APPLY_ENDPOINT),
-                headers=self._headers,
-                data=json.dumps(data),
-                verify=self.verify,
-                timeout=self.timeout,
-            )
-            result = BsrApiPermsRespose(resp.json())
-            if result.failed:
-                raise DatasetQueryError(result.error_code, None, result.stderr)
-            return result
-
-    def share_dataset(
-        self, ds_path: str, nfs_opts=None, smb_opts=None, requests=requests
-    ):
+        resp = self._send(
+            "POST",
+            self._url_perms_apply,
+            data=_dumps(data),
+            verify=self.verify,
+            timeout=self.timeout,
+        )
+        result = BsrApiPermsRespose(self._parse(resp))
+        if result.failed:
+            raise DatasetQueryError(result.error_code, None, result.stderr)
+        return result
+
+    def set_dataset_perms_many(
+        self, items
+    ) -> List[Tuple[BsrApiPermsRespose, BsrApiPermsRespose]]:
+        """Modifies ACLs and ownership on a number of datasets at once. Lookups of
+        dataset IDs happen concurrently, followed by concurrent application of
+        the ACLs, instead of two round trips per dataset one after another.
+
+        Args:
+            items (List[Tuple]): Tuples of (ds_path, acl, owner_sid, owner_group_sid, recursive), same as arguments to set_dataset_perms except for the path in place of the ID.
+
+        Raises:
+            DatasetQueryError: An exception with some information about what failed. Raised for the first item which failed, in the order of items.
+
+        Returns:
+            List[Tuple[BsrApiPermsRespose, BsrApiPermsRespose]]: Settings before and after the change, for each of the items in order.
+        """
+        if not items:
+            return []
+        # Make sure we have a token before fanning out, otherwise each worker
+        # would try to login on its own.
+        self.auth_if_required()
+        workers = min(len(items), API_PERMS_WORKERS, self._pool_maxsize)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self.get_dataset_perms, i[0]) for i in items]
+            # Calling result() re-raises any exception raised by the lookup.
+            before = [future.result() for future in futures]
+            futures = [
+                executor.submit(
+                    self.set_dataset_perms, old.dataset_id, acl, sid, gsid, recursive
+                )
+                for old, (_, acl, sid, gsid, recursive) in zip(before, items)
+            ]
+            after = [future.result() for future in futures]
+        return list(zip(before, after))
+
+    def share_dataset(self, ds_path: str, nfs_opts=None, smb_opts=None):
         pairs = []
         if nfs_opts:
             if " " in nfs_opts:
@@ -567,8 +928,8 @@ class AnsibleBsrApiClient:
                 )
             pairs.append(("sharesmb", smb_opts))
 
-        props = {k: v for k, v in pairs}
-        args = f'set {" ".join([f"{k}={v}" for k, v in props.items()])} {ds_path}'
+        self._forget_props(ds_path)
+        args = _build_set_args(pairs, ds_path)
 
         data = {
             "Command": ZFS_CMD,
@@ -576,22 +937,18 @@ class AnsibleBsrApiClient:
             "UseShell": False,
             "IsQuery": False,
         }
-        with suppress_insecure_https_warnings():
-            self.auth_if_required()
-            resp = requests.post(
-                self.url(SHELL_RUN_ENDPOINT),
-                headers=self._headers,
-                data=json.dumps(data),
-                verify=self.verify,
-                timeout=self.timeout,
-            )
-            result = BsrApiCommandResponse(resp.json())
-            if result.failed:
-                raise DatasetQueryError(result.error_code, None, result.stderr)
-            return result
+        resp = self._send(
+            "POST",
+            self._url_shell,
+            data=_dumps(data),
+            verify=self.verify,
+            timeout=self.timeout,
+        )
+        result = BsrApiCommandResponse(self._parse(resp))
+        return self._raise_command_failure(result)
 
     def unshare_dataset(
-        self, ds_path: str, disable_nfs=True, disable_smb=True, requests=requests
+        self, ds_path: str, disable_nfs=True, disable_smb=True
     ) -> BsrApiCommandResponse:
         """Disable sharing via NFS or SMB or both on a given dataset.
 
@@ -599,7 +956,6 @@ class AnsibleBsrApiClient:
             ds_path (str): Path to dataset to be destroyed.
             disable_nfs (bool, optional): Disables NFS share if True. Defaults to True.
             disable_smb (bool, optional): Disables SMB share if true. Defaults to True.
-            requests (_type_, optional): Allows injection of custom requests implementation. Defaults to requests.
 
         Raises:
             DatasetQueryError: An exception with some information about what failed.
@@ -612,8 +968,8 @@ class AnsibleBsrApiClient:
             pairs.append(("sharenfs", "off"))
         if disable_smb:
             pairs.append(("sharesmb", "off"))
-        props = {k: v for k, v in pairs}
-        args = f'set {" ".join([f"{k}={v}" for k, v in props.items()])} {ds_path}'
+        self._forget_props(ds_path)
+        args = _build_set_args(pairs, ds_path)
 
         data = {
             "Command": ZFS_CMD,
@@ -621,19 +977,64 @@ class AnsibleBsrApiClient:
             "UseShell": False,
             "IsQuery": False,
         }
-        with suppress_insecure_https_warnings():
-            self.auth_if_required()
-            resp = requests.post(
-                self.url(SHELL_RUN_ENDPOINT),
-                headers=self._headers,
-                data=json.dumps(data),
-                verify=self.verify,
-                timeout=self.timeout,
-            )
-            result = BsrApiCommandResponse(resp.json())
-            if result.failed:
-                raise DatasetQueryError(result.error_code, None, result.stderr)
-            return result
+        resp = self._send(
+            "POST",
+            self._url_shell,
+            data=_dumps(data),
+            verify=self.verify,
+            timeout=self.timeout,
+        )
+        result = BsrApiCommandResponse(self._parse(resp))
+        return self._raise_command_failure(result)
+
+    def apply_dataset_config(
+        self, ds_path: str, props=None, nfs_opts=None, smb_opts=None
+    ) -> BsrApiCommandResponse:
+        """Sets dataset properties and share settings with a single zfs set
+        command, instead of one API call for properties and another for shares.
+
+        Args:
+            ds_path (str): Properties and shares are set on this dataset.
+            props (Dict, optional): Dataset properties to set. Defaults to None.
+            nfs_opts (str, optional): Value for the sharenfs property. Defaults to None.
+            smb_opts (str, optional): Value for the sharesmb property. Defaults to None.
+
+        Raises:
+            DatasetQueryError: An exception with some information about what failed.
+            ValueError: Raised when there is nothing to set or share settings contain whitespace.
+
+        Returns:
+            BsrApiCommandResponse: Response from the API converted into a native type.
+        """
+        pairs = list(props.items()) if props else []
+        for prop, share_opts in (("sharenfs", nfs_opts), ("sharesmb", smb_opts)):
+            if share_opts:
+                if " " in share_opts:
+                    raise ValueError(
+                        "share settings must not contain whitespace characters"
+                    )
+                pairs.append((prop, share_opts))
+        if not pairs:
+            raise ValueError("nothing to set on dataset")
+
+        self._forget_props(ds_path)
+        args = _build_set_args(pairs, ds_path)
+
+        data = {
+            "Command": ZFS_CMD,
+            "Args": args,
+            "UseShell": False,
+            "IsQuery": False,
+        }
+        resp = self._send(
+            "POST",
+            self._url_shell,
+            data=_dumps(data),
+            verify=self.verify,
+            timeout=self.timeout,
+        )
+        result = BsrApiCommandResponse(self._parse(resp))
+        return self._raise_command_failure(result)
 
     def destroy_dataset(self, ds_path: str, recursive=False) -> bool:
         """Destroys datasets, potentially recursively, if the recursive flag is set.
@@ -648,67 +1049,121 @@ class AnsibleBsrApiClient:
         Returns:
             bool: True if operation succeeded, False otherwise.
         """
+        self._forget_dataset(ds_path)
         data = {"Dataset": ds_path}
-        with suppress_insecure_https_warnings():
-            self.auth_if_required()
-            resp = requests.post(
-                self.url(ZFS_DATASET_DESTROY_ENDPOINT),
-                headers=self._headers,
-                data=json.dumps(data),
-                verify=self.verify,
-                timeout=self.timeout,
-            )
-            # It is not straight-forward to tell here whether we actually
-            # succeeded or failed, because the API returns 200 and we may fail
-            # for a number of reasons, such as destroying a dataset with
-            # children. We need to inspect the payload to figure out what state
-            # we are actually in.
-            if resp.status_code != 200:
-                resp.raise_for_status()
-
-            # If there are no descendant datasets and there is no error,
-            # operation succeeded. We will succeed even if we destroy a dataset
-            # which does not exist.
-            resp_dict = resp.json()
-            if not resp_dict["Descendants"] and not resp_dict["Error"]:
-                return True
-
-            # If there are descendants and we do not have the recursive flag
-            # set, we are going to raise an exception at this point.
-            if resp_dict["Descendants"] and not recursive:
-                raise DatasetQueryError(
-                    DatasetErrors.RequiresRecursiveDestroy,
-                    "",
-                    resp_dict["Error"],
-                    resp_dict["Descendants"],
-                )
-            elif (
-                resp_dict["Descendants"] and recursive
-            ):  # Recurse through child datasets here.
-                children_unsorted = [c["Path"] for c in resp_dict["Descendants"]]
-                children_sorted = reversed(sorted(children_unsorted))
-                for child_ds in children_sorted:
-                    self.destroy_dataset(child_ds, recursive=True)
-                # Finally destroy the parent dataset.
-                self.destroy_dataset(ds_path)
+        resp = self._send(
+            "POST",
+            self._url_destroy,
+            data=_dumps(data),
+            verify=self.verify,
+            timeout=self.timeout,
+        )
+        # It is not straight-forward to tell here whether we actually
+        # succeeded or failed, because the API returns 200 and we may fail
+        # for a number of reasons, such as destroying a dataset with
+        # children. We need to inspect the payload to figure out what state
+        # we are actually in.
+        if resp.status_code != _STATUS_OK:
+            resp.raise_for_status()
+
+        # If there are no descendant datasets and there is no error,
+        # operation succeeded. We will succeed even if we destroy a dataset
+        # which does not exist.
+        resp_dict = self._parse(resp)
+        if not resp_dict["Descendants"] and not resp_dict["Error"]:
             return True
 
-    def is_existing_dataset(self, ds_path: str):
-        with suppress_insecure_https_warnings():
-            self.auth_if_required()
-            resp = requests.get(
-                self.url(ZFS_DATASET_ENDPOINT),
-                headers=self._headers,
-                params={"dataset": ds_path},
-                verify=self.verify,
-                timeout=self.timeout,
+        # If there are descendants and we do not have the recursive flag
+        # set, we are going to raise an exception at this point.
+        if resp_dict["Descendants"] and not recursive:
+            raise DatasetQueryError(
+                DatasetErrors.RequiresRecursiveDestroy,
+                "",
+                resp_dict["Error"],
+                resp_dict["Descendants"],
             )
-            if resp.status_code == 200:
-                return True
-            resp_dict = resp.json()
-            if resp.status_code == 500:
-                if resp_dict["Data"].get("Message", "") == "No such dataset.":
-                    return False
-            # FIXME: This is temporary, needs to be improved. The caller should
-            # not have to deal with errors from the http library.
-            resp.raise_for_status()
+        elif (
+            resp_dict["Descendants"] and recursive
+        ):  # Recurse through child datasets here.
+            # Datasets at the same depth do not depend on each other, so
+            # we destroy them concurrently, one level at a time starting
+            # with the deepest, since a parent cannot go before its
+            # children.
+            levels = dict()
+            for c in resp_dict["Descendants"]:
+                levels.setdefault(c["Path"].count("/"), []).append(c["Path"])
+            depths = sorted(levels, reverse=True)
+            widest = max(len(paths) for paths in levels.values())
+            if widest == 1:
+                # A simple chain of datasets gains nothing from threads.
+                for depth in depths:
+                    self.destroy_dataset(levels[depth][0], recursive=True)
+            else:
+                # There is no point in more workers than concurrent requests
+                # the connection pool can serve.
+                workers = min(widest, API_DESTROY_WORKERS, self._pool_maxsize)
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    for depth in depths:
+                        futures = [
+                            executor.submit(
+                                self.destroy_dataset, child_ds, recursive=True
+                            )
+                            for child_ds in levels[depth]
+                        ]
+                        # Calling result() re-raises any exception raised while
+                        # destroying a child, just like the serial version did.
+                        for future in futures:
+                            future.result()
+            # Finally destroy the parent dataset.
+            self.destroy_dataset(ds_path)
+        return True
+
+    def is_existing_dataset(self, ds_path: str):
+        # Playbooks tend to check for a dataset right before acting on it, so
+        # we remember recent answers. Creating or destroying a dataset through
+        # this client invalidates what we know about it.
+        cached = self._exists_cache.get(ds_path)
+        if cached is not None and time.monotonic() < cached[0]:
+            return cached[1]
+        resp = self._send(
+            "GET",
+            self._url_dataset,
+            params={"dataset": ds_path},
+            verify=self.verify,
+            timeout=self.timeout,
+        )
+        # We only need the payload if the dataset does not appear to exist.
+        if resp.status_code == _STATUS_OK:
+            return self._remember_exists(ds_path, True)
+        resp_dict = self._parse(resp)
+        if resp.status_code == _STATUS_ISE:
+            # Only this exact message means the dataset itself is missing; the
+            # broader known errors could also be about its parent.
+            if resp_dict["Data"].get("Message", "") == "No such dataset.":
+                return self._remember_exists(ds_path, False)
+        # FIXME: This is temporary, needs to be improved. The caller should
+        # not have to deal with errors from the http library.
+        resp.raise_for_status()
+
+    def exist_many(self, ds_paths: List[str]) -> Dict[str, bool]:
+        """Checks whether each of the given datasets exists, with the lookups
+        running concurrently instead of one round trip after another.
+
+        Args:
+            ds_paths (List[str]): Paths of datasets to look up.
+
+        Returns:
+            Dict[str, bool]: Whether or not each of the datasets exists, keyed by path.
+        """
+        if not ds_paths:
+            return {}
+        # Make sure we have a token before fanning out, otherwise each worker
+        # would try to login on its own. We use no more workers than the
+        # connection pool is sized for, otherwise connections would be
+        # discarded and opened again.
+        self.auth_if_required()
+        # Each path is only looked up once, even if it is repeated.
+        unique = list(dict.fromkeys(ds_paths))
+        workers = min(len(unique), self._pool_maxsize)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(unique, executor.map(self.is_existing_dataset, unique)))
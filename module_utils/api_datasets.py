@@ -1,6 +1,8 @@
-from copy import deepcopy
 from dataclasses import dataclass
-from typing import Dict, List
+from types import MappingProxyType
+from types import SimpleNamespace
+from typing import AbstractSet, Dict, List
+import unittest
 
 from .api import AnsibleBsrApiClient
 from .api import DatasetErrors
@@ -8,169 +10,255 @@ from .api import DatasetQueryError
 from .api import KNOWN_PROPS
 
 
-@dataclass
+@dataclass(frozen=True)
 class DatasetTaskResult:
     """
     An object normally returned to consumer of methods on the Dataset class.
     """
 
+    # Declared by hand instead of with dataclass(slots=True), which needs
+    # Python 3.10.
+    __slots__ = ("succeeded", "changed", "error", "details")
+
     succeeded: bool
     changed: bool
     error: str
     details: Dict
 
 
-IGNORED_PROPS = (
-    # "available",
-    # "logicalreferenced",
-    # "logicalused",
-    # "referenced",
-    # "used",
-    # "usedbydataset",
-    # "usedbysnapshots",
-    # "written",
+# Results of the most common outcomes which do not depend on a particular
+# dataset, i.e. when there is nothing to do. These are shared, so their details
+# are read-only; callers wanting to add to them must make a copy.
+_UNCHANGED = DatasetTaskResult(
+    succeeded=True, changed=False, error=None, details=MappingProxyType({})
+)
+_UNCHANGED_EXISTING = DatasetTaskResult(
+    succeeded=True,
+    changed=False,
+    error=None,
+    details=MappingProxyType({"outcome": "unchanged"}),
+)
+_ALREADY_ABSENT = DatasetTaskResult(
+    succeeded=True,
+    changed=False,
+    error=None,
+    details=MappingProxyType({"dataset_absent": True}),
+)
+
+
+# Both of these are only used to filter property dicts, one key at a time,
+# which is why they are frozensets.
+IGNORED_PROPS = frozenset(
+    (
+        # "available",
+        # "logicalreferenced",
+        # "logicalused",
+        # "referenced",
+        # "used",
+        # "usedbydataset",
+        # "usedbysnapshots",
+        # "written",
+    )
 )
 
-ALL_POSSIBLE_PROPS = (
-    "type",
-    "creation",
-    "used",
-    "available",
-    "referenced",
-    "compressratio",
-    "mounted",
-    "quota",
-    "reservation",
-    "recordsize",
-    "mountpoint",
-    "sharenfs",
-    "checksum",
-    "compression",
-    "atime",
-    "devices",
-    "exec",
-    "setuid",
-    "readonly",
-    "zoned",
-    "snapdir",
-    "aclmode",
-    "aclinherit",
-    "createtxg",
-    "canmount",
-    "xattr",
-    "copies",
-    "version",
-    "utf8only",
-    "normalization",
-    "casesensitivity",
-    "vscan",
-    "nbmand",
-    "sharesmb",
-    "refquota",
-    "refreservation",
-    "guid",
-    "primarycache",
-    "secondarycache",
-    "usedbysnapshots",
-    "usedbydataset",
-    "usedbychildren",
-    "usedbyrefreservation",
-    "logbias",
-    "dedup",
-    "mlslabel",
-    "sync",
-    "dnodesize",
-    "refcompressratio",
-    "written",
-    "logicalused",
-    "logicalreferenced",
-    "filesystem_limit",
-    "snapshot_limit",
-    "filesystem_count",
-    "snapshot_count",
-    "redundant_metadata",
-    "special_small_blocks",
-    "encryption",
-    "keylocation",
-    "keyformat",
-    "pbkdf2iters",
-    "smartfolders",
-    "smartfs",
-    "racktop:ub",
-    "racktop:storage_profile",
-    "racktop:ub_thresholds",
-    "racktop:ub_suspend",
-    "racktop:ub_trial",
-    "racktop:version",
-    "racktop:encoded_description",
+ALL_POSSIBLE_PROPS = frozenset(
+    (
+        "type",
+        "creation",
+        "used",
+        "available",
+        "referenced",
+        "compressratio",
+        "mounted",
+        "quota",
+        "reservation",
+        "recordsize",
+        "mountpoint",
+        "sharenfs",
+        "checksum",
+        "compression",
+        "atime",
+        "devices",
+        "exec",
+        "setuid",
+        "readonly",
+        "zoned",
+        "snapdir",
+        "aclmode",
+        "aclinherit",
+        "createtxg",
+        "canmount",
+        "xattr",
+        "copies",
+        "version",
+        "utf8only",
+        "normalization",
+        "casesensitivity",
+        "vscan",
+        "nbmand",
+        "sharesmb",
+        "refquota",
+        "refreservation",
+        "guid",
+        "primarycache",
+        "secondarycache",
+        "usedbysnapshots",
+        "usedbydataset",
+        "usedbychildren",
+        "usedbyrefreservation",
+        "logbias",
+        "dedup",
+        "mlslabel",
+        "sync",
+        "dnodesize",
+        "refcompressratio",
+        "written",
+        "logicalused",
+        "logicalreferenced",
+        "filesystem_limit",
+        "snapshot_limit",
+        "filesystem_count",
+        "snapshot_count",
+        "redundant_metadata",
+        "special_small_blocks",
+        "encryption",
+        "keylocation",
+        "keyformat",
+        "pbkdf2iters",
+        "smartfolders",
+        "smartfs",
+        "racktop:ub",
+        "racktop:storage_profile",
+        "racktop:ub_thresholds",
+        "racktop:ub_suspend",
+        "racktop:ub_trial",
+        "racktop:version",
+        "racktop:encoded_description",
+    )
 )
 
 
+# When configuring a share we only care about changes to these properties, so
+# everything else is filtered out.
+_SHARE_FILTER = ALL_POSSIBLE_PROPS - {"sharesmb", "racktop:ub"}
+
+
+def _dict_delta(before: Dict, after: Dict) -> Dict:
+    """Finds entries which are new or have changed between two dicts. Values
+    are compared directly, so they do not need to be hashable.
+
+    Args:
+        before (Dict): Dictionary as it was before a change.
+        after (Dict): Dictionary as it is after a change.
+
+    Returns:
+        Dict: Entries from after which are missing from, or differ in, before.
+    """
+    return {k: v for k, v in after.items() if k not in before or before[k] != v}
+
+
+def _ace_key(ace):
+    """Hashable equivalent of an ACE, so that ACLs can be compared with sets.
+    Values may themselves be dicts or lists, e.g. resolved identities, which
+    are converted in the same way.
+
+    Args:
+        ace (Dict): Single access control entry.
+
+    Returns:
+        frozenset: Items of the ACE, with dicts converted to frozensets of
+        their items and lists to tuples.
+    """
+    if isinstance(ace, dict):
+        return frozenset((k, _ace_key(v)) for k, v in ace.items())
+    if isinstance(ace, list):
+        return tuple(_ace_key(v) for v in ace)
+    return ace
+
+
 class Dataset:
     """
     Dataset is class encapsulating methods used to manage datasets on the
     BrickStor appliance.
     """
 
+    # _api_props holds the result of _dataset_props until props change.
+    __slots__ = ("props", "_api_props")
+
     # Most of these settings we will never change. But, we are passing all the
     # settings to the backend as opposed to inheriting settings from the parent
     # dataset when we are creating a new dataset. Otherwise the dataset we are
     # creating may inherit settings which we do not actually desire.
-    DEFAULT_DATASET_PROPS = {
-        "aclinherit": "passthrough",
-        "aclmode": "passthrough",
-        "atime": "on",
-        "canmount": "on",
-        "checksum": "fletcher4",
-        "compression": "lz4",
-        "copies": 1,
-        "devices": "on",
-        "exec": "on",
-        "filesystem_limit": None,
-        "logbias": "latency",
-        "nbmand": "on",
-        "casesensitivity": "mixed",
-        "normalization": None,
-        "utf8only": "off",
-        "primarycache": "all",
-        "quota": None,
-        "readonly": "off",
-        "recordsize": 131072,
-        "redundant_metadata": "all",
-        "refquota": None,
-        "refreservation": None,
-        "reservation": None,
-        "secondarycache": "all",
-        "setuid": "on",
-        "snapdir": "hidden",
-        "snapshot_limit": None,
-        "sync": "standard",
-        "vscan": "off",
-        "xattr": "on",
-        "zoned": "off",
-        "racktop:storage_profile": "general_filesystem",
-        "racktop:encoded_description": "",
-        "smartfolders": "off",
-        "racktop:ub": "on",
-        "racktop:ub_suspend": "",
-        "racktop:ub_thresholds": "null",  # We store some things as 'none' and some as 'null', like this one
-        "racktop:ub_trial": "",
-        "racktop:version": 1,
-        "sharenfs": "off",
-        "sharesmb": "off",
-    }
+    #
+    # The defaults are read-only, so that they can be handed out without a
+    # defensive copy; instances copy them into their own props.
+    DEFAULT_DATASET_PROPS = MappingProxyType(
+        {
+            "aclinherit": "passthrough",
+            "aclmode": "passthrough",
+            "atime": "on",
+            "canmount": "on",
+            "checksum": "fletcher4",
+            "compression": "lz4",
+            "copies": 1,
+            "devices": "on",
+            "exec": "on",
+            "filesystem_limit": None,
+            "logbias": "latency",
+            "nbmand": "on",
+            "casesensitivity": "mixed",
+            "normalization": None,
+            "utf8only": "off",
+            "primarycache": "all",
+            "quota": None,
+            "readonly": "off",
+            "recordsize": 131072,
+            "redundant_metadata": "all",
+            "refquota": None,
+            "refreservation": None,
+            "reservation": None,
+            "secondarycache": "all",
+            "setuid": "on",
+            "snapdir": "hidden",
+            "snapshot_limit": None,
+            "sync": "standard",
+            "vscan": "off",
+            "xattr": "on",
+            "zoned": "off",
+            "racktop:storage_profile": "general_filesystem",
+            "racktop:encoded_description": "",
+            "smartfolders": "off",
+            "racktop:ub": "on",
+            "racktop:ub_suspend": "",
+            "racktop:ub_thresholds": "null",  # We store some things as 'none' and some as 'null', like this one
+            "racktop:ub_trial": "",
+            "racktop:version": 1,
+            "sharenfs": "off",
+            "sharesmb": "off",
+        }
+    )
     """Describes dataset properties. The API returns a JSON representation
     which we convert into a Python native object. This same class is also used
     to realize changes to existing datasets or creation of new datasets with
     desired property settings.
     """
 
-    def __init__(self, props=None) -> None:
-        self.props = None
-        # If props is not None or empty, we deepcopy the contents into our own
-        # self.props attribute.
-        if props is not None:
-            self.props = deepcopy(props)
+    def __init__(self, props=None, copy=True) -> None:
+        # If props is not None or empty, we copy the contents into our own
+        # self.props attribute. Property values are scalars, so a shallow copy
+        # is enough and much cheaper than a deepcopy. Callers which hand over
+        # a dict they no longer use can pass copy=False to skip the copy.
+        if props is None or not copy:
+            self.props = props
+        else:
+            self.props = dict(props)
+        self._api_props = None
+
+    def _props_changed(self):
+        """Must be called whenever self.props is modified, so that properties
+        formatted for the API are computed again the next time they are needed.
+        """
+        self._api_props = None
 
     def merge(self, **changes):
         """Merges dataset properties that are part of this class with supplied properties.
@@ -178,74 +266,72 @@ class Dataset:
         Raises:
             KeyError: A key must be known in order for update to succeed. Unknown keys cause an exception to be raised.
         """
+        props = self.props
+        known = KNOWN_PROPS
         for k, v in changes.items():
-            if not k in KNOWN_PROPS:
+            if k not in known:
                 raise KeyError(
                     f"Cannot update '{k}'; because it is not a known property name"
                 )
-            # We do a bunch of hacky stuff here when we merge settings, because
-            # there are inconsistencies in the representation of the data
-            # between ZFS props, the API and defaults here.
-            if type(v) != type(self.props[k]):
-                if isinstance(self.props[k], int):
-                    if v is None:
-                        self.props[k] = None
-                        continue
-            self.props[k] = v
+            # There are inconsistencies in the representation of the data
+            # between ZFS props, the API and defaults here, e.g. an int prop
+            # may be given as None to mean there is no limit. Values are kept
+            # as given and only converted for the API in _dataset_props, so no
+            # per-key type checks are needed here.
+            props[k] = v
+        self._props_changed()
 
     def diff(self, other: Dict):
-        # First we create a temporary _partial_ view of our properties,
-        # containing only props present in the 'other' dict. We then return
-        # what amounts to a set difference between our dict and 'other'.
-        partial = dict()
+        # We return the props in 'other' whose values differ from ours. Values
+        # are compared directly, so they do not need to be hashable.
         # If 'other' is an empty dict, we are going to get back an empty dict
         # since there won't be anything selected from our dict.
-        for k, _ in other.items():
-            if k not in self.props:
-                raise KeyError(f"Property '{k}' is not known")
-            partial[k] = self.props[k]
-        return dict(set(other.items()) - set(partial.items()))
+        # Unknown props are found with a single set operation on the key views.
+        if not other.keys() <= self.props.keys():
+            unknown = next(k for k in other if k not in self.props)
+            raise KeyError(f"Property '{unknown}' is not known")
+        return {k: v for k, v in other.items() if self.props[k] != v}
 
     @property
     def _dataset_props(self) -> Dict:
         """Tweaks certain dataset properties to make sure that they are accepted by the API.
+        The result is computed once and kept until self.props is modified.
 
         Returns:
             Dict: Properties formatted correctly for comsumption by the API.
         """
-        output = dict()
-        for k, v in self.props.items():
-            if v == None:
-                output[k] = "none"
-            elif isinstance(v, int):
-                output[k] = str(v)
-            else:
-                output[k] = v
-        return output
-
-    def _filtered_dict(self, d: Dict, excludes: List[str]):
-        """Filters a given dict by excluding keys matching those in the excludes list.
+        if self._api_props is None:
+            self._api_props = {
+                k: "none" if v is None else str(v) if isinstance(v, int) else v
+                for k, v in self.props.items()
+            }
+        return self._api_props
+
+    def _filtered_dict(self, d: Dict, excludes: AbstractSet[str]):
+        """Filters a given dict by excluding keys matching those in the excludes set.
 
         Args:
-            d (Dict): Dictionary to filter with the excludes list.
-            excludes (List[str]): List of keys to exclude from the dict.
+            d (Dict): Dictionary to filter with the excludes set.
+            excludes (AbstractSet[str]): Set of keys to exclude from the dict.
 
-        Yields:
-            Tuple[str, Any]: Key/Value pairs that made it through the filter.
+        Returns:
+            Dict: Key/Value pairs that made it through the filter.
         """
-        for k, v in d.items():
-            if k in excludes:
-                continue
-            yield (k, v)
+        return {k: v for k, v in d.items() if k not in excludes}
 
     def _seed_with_default_props(self):
         """
         Initializes internal dataset representation with default dataset properties.
+        Properties already set on this instance take precedence over defaults.
         """
-        if self.props is None:
-            self.props = deepcopy(Dataset.DEFAULT_DATASET_PROPS)
-        else:
-            self.props.update(Dataset.DEFAULT_DATASET_PROPS)
+        # copy() goes straight to the dict behind the proxy, which is many
+        # times faster than dict() iterating over the proxy, or than updating
+        # an existing dict key by key.
+        merged = Dataset.DEFAULT_DATASET_PROPS.copy()
+        if self.props is not None:
+            merged.update(self.props)
+        self.props = merged
+        self._props_changed()
 
     def set_dataset_properties(
         self, ds_path, api_client: AnsibleBsrApiClient, **props
@@ -259,6 +345,9 @@ class Dataset:
         Returns:
             DatasetTaskResult: Describes the outcome from the request made to the shell API.
         """
+        # Nothing was asked for, so there is no reason to query the dataset.
+        if not props:
+            return _UNCHANGED
         # First, we need to determine if changes are necessary.
         current_properties = dict()
         try:
@@ -273,17 +362,9 @@ class Dataset:
                     },
                     error="Unable to obtain current properties because dataset does not exist",
                 )
-        partial = dict()
-        for key in props.keys():
-            partial[key] = current_properties[key]
-        changes = dict(set(props.items() - set(partial.items())))
+        changes = {k: v for k, v in props.items() if current_properties[k] != v}
         if not changes:
-            return DatasetTaskResult(
-                succeeded=True,
-                changed=False,
-                details={},
-                error=None,
-            )
+            return _UNCHANGED
         _ = api_client.set_dataset_properties(ds_path, **changes)
         return DatasetTaskResult(
             succeeded=True,
@@ -311,14 +392,7 @@ class Dataset:
             self._seed_with_default_props()
             if props:
                 self.merge(**props)
-        except KeyError as err:
-            return DatasetTaskResult(
-                succeeded=False,
-                changed=False,
-                error=err.args[0],
-                details={},
-            )
-        except TypeError as err:
+        except (KeyError, TypeError) as err:
             return DatasetTaskResult(
                 succeeded=False,
                 changed=False,
@@ -348,7 +422,11 @@ class Dataset:
             props_before = self._filtered_dict(
                 api_client.get_dataset_properties(ds_path), IGNORED_PROPS
             )
+            # Deliberately not merged with the seeded defaults. Defaults only
+            # apply to new datasets, an existing one should only be changed
+            # in the properties the caller explicitly asked for.
             self.props = props
+            self._props_changed()
             # This is spaghetti code and it will need to be improved.
             # Exceptions here make sense, but nesting them is less than ideal.
             try:
@@ -356,9 +434,7 @@ class Dataset:
                 props_after = self._filtered_dict(
                     api_client.get_dataset_properties(ds_path), IGNORED_PROPS
                 )
-                diff = dict(
-                    set(set(dict(props_after).items() - dict(props_before).items()))
-                )
+                diff = _dict_delta(props_before, props_after)
                 if diff:
                     return DatasetTaskResult(
                         succeeded=True,
@@ -366,14 +442,7 @@ class Dataset:
                         error=None,
                         details={"outcome": "modified", "updates": diff},
                     )
-                return DatasetTaskResult(
-                    succeeded=True,
-                    changed=False,
-                    error=None,
-                    details={
-                        "outcome": "unchanged",
-                    },
-                )
+                return _UNCHANGED_EXISTING
             except DatasetQueryError as err:
                 return DatasetTaskResult(
                     succeeded=False,
@@ -402,12 +471,7 @@ class Dataset:
         self, ds_path, api_client: AnsibleBsrApiClient, recursive=False
     ):
         if not api_client.is_existing_dataset(ds_path):
-            return DatasetTaskResult(
-                succeeded=True,
-                changed=False,
-                error=None,
-                details={"dataset_absent": True},
-            )
+            return _ALREADY_ABSENT
         try:
             _ = api_client.destroy_dataset(ds_path, recursive)
         except DatasetQueryError as err:
@@ -465,8 +529,6 @@ class Dataset:
 
         old_acl = old_settings.acl
         new_acl = new_settings.acl
-        removed = []
-        added = []
         owner_sid_changed = old_settings.owner_sid != new_settings.owner_sid
         owner_group_sid_changed = (
             old_settings.owner_group_sid != new_settings.owner_group_sid
@@ -477,20 +539,14 @@ class Dataset:
 
         # Resolve differences between the original ACL and the new ACL.
         # We create two lists here, one which contains additions and another containing removals.
-        for a in old_acl:
-            found = False
-            for b in new_acl:
-                if a == b:
-                    found = True
-            if not found:
-                removed.append(a)
-        for a in new_acl:
-            found = False
-            for b in old_acl:
-                if a == b:
-                    found = True
-            if not found:
-                added.append(a)
+        # Each ACE is hashed once, which keeps this linear in the size of the
+        # ACLs while preserving the order in which entries appear.
+        old_keys = [_ace_key(a) for a in old_acl]
+        new_keys = [_ace_key(b) for b in new_acl]
+        old_set = set(old_keys)
+        new_set = set(new_keys)
+        removed = [a for a, k in zip(old_acl, old_keys) if k not in new_set]
+        added = [b for b, k in zip(new_acl, new_keys) if k not in old_set]
 
         changed = changed or added != [] or removed != []
 
@@ -518,23 +574,12 @@ class Dataset:
         Returns:
             DatasetTaskResult: Describes the outcome from the request made to the shell API.
         """
-        if not api_client.is_existing_dataset(ds_path):
-            return DatasetTaskResult(
-                succeeded=False,
-                changed=False,
-                error=f"cannot share non-existent dataset {ds_path}",
-                details={},
-            )
-
-        filtered = tuple(
-            [p for p in ALL_POSSIBLE_PROPS if p not in ("sharesmb", "racktop:ub")]
-        )
-        props_before = dict(
-            self._filtered_dict(api_client.get_dataset_properties(ds_path), filtered)
-        )
-
+        # Properties are looked up before and after they are set by the client
+        # in one go, which also tells us whether the dataset exists.
         try:
-            api_client.set_dataset_properties(ds_path, **self._dataset_props)
+            outcome = api_client.reconcile_dataset_properties(
+                ds_path, **self._dataset_props
+            )
         except DatasetQueryError as err:
             return DatasetTaskResult(
                 succeeded=False,
@@ -542,12 +587,18 @@ class Dataset:
                 error=err.args[0],
                 details={"operation": "setting dataset share properties"},
             )
+        if not outcome["existed"]:
+            return DatasetTaskResult(
+                succeeded=False,
+                changed=False,
+                error=f"cannot share non-existent dataset {ds_path}",
+                details={},
+            )
 
-        props_after = dict(
-            self._filtered_dict(api_client.get_dataset_properties(ds_path), filtered)
-        )
+        props_before = self._filtered_dict(outcome["before"], _SHARE_FILTER)
+        props_after = self._filtered_dict(outcome["after"], _SHARE_FILTER)
 
-        changed = dict(set(set(props_after.items() - props_before.items())))
+        changed = _dict_delta(props_before, props_after)
 
         details = dict()
         if changed:
@@ -564,3 +615,45 @@ class Dataset:
             error="",
             details=details,
         )
+
+
+class TestSetPermissions(unittest.TestCase):
+    class _Client:
+        def __init__(self, old_acl, new_acl):
+            self._old = SimpleNamespace(
+                dataset_id="id", acl=old_acl, owner_sid="S-1", owner_group_sid="S-2"
+            )
+            self._new = SimpleNamespace(
+                dataset_id="id", acl=new_acl, owner_sid="S-1", owner_group_sid="S-2"
+            )
+
+        def get_dataset_perms(self, ds_path):
+            return self._old
+
+        def set_dataset_perms(self, ds_id, acl, owner_sid, owner_group_sid, recursive):
+            return self._new
+
+    def _ace(self, name, flags):
+        return {
+            "Identity": {"Name": name, "Sids": [{"Sid": "S-1-5-21-1"}]},
+            "Flags": flags,
+            "Mask": 2032127,
+        }
+
+    def test_nested_aces_are_compared_by_value(self):
+        kept = self._ace("alpha", ["FileInherit"])
+        gone = self._ace("beta", ["FileInherit", "DirectoryInherit"])
+        new = self._ace("beta", ["FileInherit"])
+        client = self._Client([kept, gone], [self._ace("alpha", ["FileInherit"]), new])
+        resp = Dataset().set_permissions("p01/global/ds", [], "S-1", "S-2", client)
+        self.assertTrue(resp.changed)
+        self.assertEqual(resp.details["added_acl"], [new])
+        self.assertEqual(resp.details["removed_acl"], [gone])
+
+    def test_unchanged_nested_aces(self):
+        acl = [self._ace("alpha", ["FileInherit"])]
+        client = self._Client(acl, [self._ace("alpha", ["FileInherit"])])
+        resp = Dataset().set_permissions("p01/global/ds", acl, "S-1", "S-2", client)
+        self.assertFalse(resp.changed)
+        self.assertEqual(resp.details["added_acl"], [])
+        self.assertEqual(resp.details["removed_acl"], [])
@@ -1,12 +1,75 @@
+import bisect
+from functools import lru_cache
 import ipaddress
-import re
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 import unittest
 
 
-IP4_RE = re.compile(
-    r"(\b25[0-5]|\b2[0-4][0-9]|\b[01]?[0-9][0-9]?)(\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)){3}"
-)
+def _looks_like_ip4(token: str) -> bool:
+    """Tells whether a token starts out like a dotted-quad IPv4 address or
+    network. This is only a cheap first pass, anything which looks like an
+    address still has to be validated; e.g. 10.5.101.300/24 looks like one,
+    but is not valid.
+
+    Args:
+        token (str): Single element of an access list.
+
+    Returns:
+        bool: True if the token should be validated as an address or network.
+    """
+    parts = token.split(".", 3)
+    return (
+        len(parts) == 4
+        and parts[0].isdigit()
+        and parts[1].isdigit()
+        and parts[2].isdigit()
+        and parts[3][:1].isdigit()
+    )
+
+
+def _ip4_to_int(addr: str) -> Optional[int]:
+    """Converts a plain dotted-quad address to its integer form in a single
+    walk over the octets.
+
+    Args:
+        addr (str): Address such as 192.168.100.5.
+
+    Returns:
+        int or None: Integer value of the address, or None if the string is
+        anything other than four plain decimal octets, in which case it is
+        left to ipaddress to decide, and explain, what is wrong with it.
+    """
+    octets = addr.split(".")
+    if len(octets) != 4:
+        return None
+    value = 0
+    for octet in octets:
+        # Leading zeros are ambiguous and ipaddress has its own rules for
+        # them, which depend on the Python version.
+        if not (0 < len(octet) < 4 and octet.isascii() and octet.isdigit()):
+            return None
+        if len(octet) > 1 and octet[0] == "0":
+            return None
+        n = int(octet)
+        if n > 255:
+            return None
+        value = (value << 8) | n
+    return value
+
+
+# Address objects are immutable, so the same parsed object can safely be handed
+# out for every occurrence of a string; e.g. the same management network
+# appearing in the ACLs of several shares.
+@lru_cache(maxsize=1024)
+def _parse_addr(addr: str) -> ipaddress.IPv4Address:
+    # Building from an int skips the string parsing in ipaddress.
+    value = _ip4_to_int(addr)
+    return ipaddress.IPv4Address(addr if value is None else value)
+
+
+@lru_cache(maxsize=1024)
+def _parse_net(net: str) -> ipaddress.IPv4Network:
+    return ipaddress.IPv4Network(net)
 
 
 class InvalidAddressSpecification(Exception):
@@ -16,16 +79,19 @@ class InvalidAddressSpecification(Exception):
 class IPNetHostList:
     """Provides a class with convenience methods over the list of nets and hosts to be included in the ACL."""
 
+    __slots__ = ("_addrs", "_addrs_list", "_hosts", "_nets", "_others", "_fmt")
+
     def __init__(self, addrs: str or List[str] = None):
         self._addrs_list = None
+        self._fmt = None
         if isinstance(addrs, list):
-            self._addrs_list = addrs
+            tokens = addrs
         elif isinstance(addrs, str):
             self._addrs = addrs
-            self._addrs_list = self._list_from_addrs_string()
+            tokens = addrs.split(":")
         else:
             raise TypeError("Only str and list are valid types for addrs")
-        self._hosts, self._nets, self._others = self._split_nets_and_hosts()
+        self._parse(tokens)
 
     @property
     def hosts(self):
@@ -40,98 +106,145 @@ class IPNetHostList:
         return self._others
 
     def __str__(self):
-        addrs = []
-        for elem in self.nets + self.hosts:
-            addrs.append("@" + str(elem))
-        addrs += self._others
-        return ":".join(addrs)
+        # Nothing changes once the list is parsed, so format it only once.
+        if self._fmt is None:
+            addrs = []
+            for elem in self.nets + self.hosts:
+                addrs.append("@" + str(elem))
+            addrs += self._others
+            self._fmt = ":".join(addrs)
+        return self._fmt
 
     def __len__(self):
         return len(self.hosts) + len(self.nets)
 
-    def _validate_addr(self, host_or_net_addr: str):
+    def _validate_addr(
+        self, host_or_net_addr: str
+    ) -> ipaddress.IPv4Address or ipaddress.IPv4Network:
         # If there is a slash '/' in the address, it is a network.
         if "/" in host_or_net_addr:  # network address case
             try:
                 # FIXME: We probably should be doing more validation here, but
                 # for now this is sufficient to know that the thing is at least
                 # valid.
-                _ = ipaddress.IPv4Network(host_or_net_addr)
+                return _parse_net(host_or_net_addr)
             except ipaddress.NetmaskValueError as err:
                 raise InvalidAddressSpecification(err.args[0])
             except ValueError as err:
                 raise InvalidAddressSpecification(err.args[0])
         else:  # host address case
             try:
-                addr = ipaddress.IPv4Address(host_or_net_addr)
+                addr = _parse_addr(host_or_net_addr)
                 # Loopback address is not legal in this context
                 if addr.is_loopback:
                     raise InvalidAddressSpecification(
                         f"Local address {host_or_net_addr} not allowed"
                     )
+                return addr
             except ipaddress.AddressValueError as err:
                 raise InvalidAddressSpecification(err.args[0])
 
-    def _list_from_addrs_string(self) -> Tuple[str]:
-        addrs_list = []
-        tokens = self._addrs.split(":")
-        if not tokens:
-            return tuple()
-        # Validate that what we have looks like valid IP addresses/ranges.
+    def _parse(self, tokens: List[str]):
+        """Validates the given tokens and sorts them into hosts, networks and
+        other names in a single pass. Addresses are parsed exactly once, the
+        parsed objects are what ends up in hosts and nets.
+
+        Args:
+            tokens (List[str]): Elements of the access list.
+
+        Raises:
+            InvalidAddressSpecification: Any token which looks like an address
+            or network, but is not a valid one.
+        """
+        addrs_list: List[str] = list()
+        hosts: List[ipaddress.IPv4Address] = list()
+        nets: List[ipaddress.IPv4Network] = list()
+        other: List[str] = list()
         for token in tokens:
             if token == "":
                 continue
             # IP addresses and network ranges are prefixed with '@'.
             elif token[0] == "@":
-                # If not valid, this will raise an exception.
-                self._validate_addr(token[1:])
-                addrs_list.append(token)
+                addr = token[1:]
             # This is a IPv4 address, but apparently lacks the '@' prefix.
-            elif IP4_RE.match(token):
-                self._validate_addr(token)
-                addrs_list.append("@" + token)
+            elif _looks_like_ip4(token):
+                addr = token
             # Anything else, i.e. hostname, FQDN, etc.
             else:
                 addrs_list.append(token)
-        return tuple(addrs_list)
-
-    def _split_nets_and_hosts(
-        self,
-    ) -> Tuple[Tuple[ipaddress.IPv4Address], Tuple[ipaddress.IPv4Network], Tuple[str]]:
-        addrs_list = self._addrs_list
-        hosts: List[ipaddress.IPv4Address] = list()
-        nets: List[ipaddress.IPv4Network] = list()
-        other: List[str] = list()
-        for elem in addrs_list:
-            if elem == "":
+                other.append(token)
                 continue
-            if elem[0].isalpha():
-                other.append(elem)
-            elif "/" in elem:
-                if elem[0] == "@":
-                    n = ipaddress.IPv4Network(elem[1:])
-                else:
-                    n = ipaddress.IPv4Network(elem)
-                nets.append(n)
+            # If not valid, this will raise an exception.
+            parsed = self._validate_addr(addr)
+            addrs_list.append("@" + addr)
+            if "/" in addr:
+                nets.append(parsed)
             else:
-                if elem[0] == "@":
-                    h = ipaddress.IPv4Address(elem[1:])
-                else:
-                    h = ipaddress.IPv4Address(elem)
-                hosts.append(h)
-        return tuple(hosts), tuple(nets), tuple(other)
+                hosts.append(parsed)
+        self._addrs_list = tuple(addrs_list)
+        self._hosts, self._nets, self._others = tuple(hosts), tuple(nets), tuple(other)
+
+
+def _net_index(
+    nets: Tuple[ipaddress.IPv4Network],
+) -> Tuple[List[int], List[int]]:
+    """Builds an index over the networks for fast overlap lookups. Networks
+    are reduced to integer ranges sorted by their first address, and for
+    every position the highest last address seen up to that point is kept.
+
+    Args:
+        nets (Tuple[ipaddress.IPv4Network]): Networks to index.
+
+    Returns:
+        Tuple[List[int], List[int]]: First addresses and running maximum of
+        last addresses, in the same sorted order.
+    """
+    ranges = sorted(
+        (int(net.network_address), int(net.broadcast_address)) for net in nets
+    )
+    starts: List[int] = list()
+    max_ends: List[int] = list()
+    max_end = -1
+    for start, end in ranges:
+        starts.append(start)
+        max_end = max(max_end, end)
+        max_ends.append(max_end)
+    return starts, max_ends
+
 
+def _overlaps_any(index: Tuple[List[int], List[int]], lo: int, hi: int) -> bool:
+    """Tells whether the range lo..hi overlaps any network in the index.
 
-def raise_on_conflict(ro_list: IPNetHostList, rw_list: IPNetHostList):
+    Args:
+        index (Tuple[List[int], List[int]]): Index built with _net_index.
+        lo (int): First address of the range.
+        hi (int): Last address of the range.
+
+    Returns:
+        bool: True if at least one of the indexed networks overlaps the range.
+    """
+    starts, max_ends = index
+    # Only networks starting at or before the end of the range can overlap it,
+    # and of those it is enough to know how far the furthest one reaches.
+    i = bisect.bisect_right(starts, hi)
+    return i > 0 and max_ends[i - 1] >= lo
+
+
+def raise_on_conflict(
+    ro_list: Optional[IPNetHostList], rw_list: Optional[IPNetHostList]
+):
     """Raises an exception if there is a conflict between the two lists. These lists are mutually exclusive.
 
     Args:
-        ro_list (IPNetHostList): List of networks and hosts in the Read-Only ACL
-        rw_list (IPNetHostList): List of networks and hosts in the Read-Write ACL
+        ro_list (IPNetHostList or None): List of networks and hosts in the Read-Only ACL, None if there is no such ACL
+        rw_list (IPNetHostList or None): List of networks and hosts in the Read-Write ACL, None if there is no such ACL
 
     Raises:
         InvalidAddressSpecification: Any conflict, such as overlap between ACLs leads to this exception being raised.
     """
+    # Nothing can conflict with a list which is not there.
+    if ro_list is None or rw_list is None:
+        return
     ro_hosts = ro_list.hosts
     ro_nets = ro_list.nets
     ro_others = ro_list.others
@@ -139,35 +252,40 @@ def raise_on_conflict(ro_list: IPNetHostList, rw_list: IPNetHostList):
     rw_nets = rw_list.nets
     rw_others = rw_list.others
     # First, make sure we do not have any host addresses in both groups.
+    rw_host_set = set(rw_hosts)
     for ro_host in ro_hosts:
-        for rw_host in rw_hosts:
-            if ro_host == rw_host:
-                raise InvalidAddressSpecification(
-                    f"Found host address {str(ro_host)} in read/write and read-only lists"
-                )
+        if ro_host in rw_host_set:
+            raise InvalidAddressSpecification(
+                f"Found host address {str(ro_host)} in read/write and read-only lists"
+            )
     # Check network overlaps.
+    ro_index = _net_index(ro_nets)
+    rw_index = _net_index(rw_nets)
     for ro_net in ro_nets:
-        for rw_net in rw_nets:
-            if ro_net.overlaps(rw_net):
-                raise InvalidAddressSpecification(
-                    f"Found network address {str(ro_net)} in read/write and read-only lists"
-                )
+        if _overlaps_any(
+            rw_index, int(ro_net.network_address), int(ro_net.broadcast_address)
+        ):
+            raise InvalidAddressSpecification(
+                f"Found network address {str(ro_net)} in read/write and read-only lists"
+            )
     # Check for any host addresses that may belong to network in the other
-    # list.
+    # list. The index only tells us that there is such a network, the list
+    # is scanned again to report the first one, as it is found in the list.
     for ro_host in ro_hosts:
-        for rw_net in rw_nets:
-            if ro_host in rw_net:
-                raise InvalidAddressSpecification(
-                    f"Found host address {str(ro_host)} in read-only list belonging to network address {rw_net} in read/write list"
-                )
+        if _overlaps_any(rw_index, int(ro_host), int(ro_host)):
+            rw_net = next(n for n in rw_nets if ro_host in n)
+            raise InvalidAddressSpecification(
+                f"Found host address {str(ro_host)} in read-only list belonging to network address {rw_net} in read/write list"
+            )
     for rw_host in rw_hosts:
-        for ro_net in ro_nets:
-            if rw_host in ro_net:
-                raise InvalidAddressSpecification(
-                    f"Found host address {str(rw_host)} in read/write list belonging to network address {ro_net} in read-only list"
-                )
+        if _overlaps_any(ro_index, int(rw_host), int(rw_host)):
+            ro_net = next(n for n in ro_nets if rw_host in n)
+            raise InvalidAddressSpecification(
+                f"Found host address {str(rw_host)} in read/write list belonging to network address {ro_net} in read-only list"
+            )
+    rw_others_set = set(rw_others)
     for ro_other in ro_others:
-        if ro_other in rw_others:
+        if ro_other in rw_others_set:
             raise InvalidAddressSpecification(
                 f"Found name {ro_other} in read-only and read/write lists"
             )
@@ -275,6 +393,12 @@ class TestIPNetHostList(unittest.TestCase):
             "Found host address 10.100.10.5 in read/write and read-only lists",
         )
 
+    def test_validation_allows_missing_list(self):
+        test_list = IPNetHostList("10.100.10.0/24:192.168.100.1")
+        raise_on_conflict(None, test_list)
+        raise_on_conflict(test_list, None)
+        raise_on_conflict(None, None)
+
     def test_hosts_property_correct(self):
         test_list = IPNetHostList(
             "10.100.10.0/24:10.2.0.0/16:192.168.100.1:192.168.100.5"
@@ -309,3 +433,93 @@ class TestIPNetHostList(unittest.TestCase):
             test_list.others,
             ("alpha.beta.com", "beta.alpha.com"),
         )
+
+
+class TestRaiseOnConflict(unittest.TestCase):
+    def test_nested_nets_conflict(self):
+        for ro, rw in (("10.0.0.0/8", "10.1.2.0/24"), ("10.1.2.0/24", "10.0.0.0/8")):
+            with self.assertRaisesRegex(
+                InvalidAddressSpecification, f"network address {ro} "
+            ):
+                raise_on_conflict(IPNetHostList(ro), IPNetHostList(rw))
+
+    def test_adjacent_nets_do_not_conflict(self):
+        raise_on_conflict(
+            IPNetHostList("10.0.0.0/25:10.0.1.0/24"),
+            IPNetHostList("10.0.0.128/25:10.0.2.0/24"),
+        )
+
+    def test_host_on_net_boundary(self):
+        rw = IPNetHostList("10.0.1.0/24")
+        for host in ("10.0.1.0", "10.0.1.255"):
+            with self.assertRaisesRegex(
+                InvalidAddressSpecification,
+                f"host address {host} in read-only list belonging to network address 10.0.1.0/24",
+            ):
+                raise_on_conflict(IPNetHostList(host), rw)
+        raise_on_conflict(IPNetHostList("10.0.0.255:10.0.2.0"), rw)
+
+    def test_host_in_net_sorted_earlier(self):
+        # The host is past the start of 10.5.0.0/16, which ends before it, so
+        # only the wider network sorted before that one contains it.
+        ro = IPNetHostList("10.200.0.0/16:10.5.0.0/16:10.0.0.0/8")
+        with self.assertRaisesRegex(
+            InvalidAddressSpecification,
+            "host address 10.100.0.1 in read/write list belonging to network address 10.0.0.0/8",
+        ):
+            raise_on_conflict(ro, IPNetHostList("10.100.0.1"))
+        raise_on_conflict(
+            IPNetHostList("10.5.0.0/16:10.200.0.0/16"), IPNetHostList("10.100.0.1")
+        )
+
+    def test_overlaps_any_matches_pairwise_check(self):
+        nets = tuple(
+            ipaddress.IPv4Network(n)
+            for n in ("10.0.0.0/8", "10.5.0.0/16", "10.200.0.0/16", "192.168.1.0/24")
+        )
+        index = _net_index(nets)
+        for probe in (
+            "9.255.255.255/32",
+            "10.0.0.0/32",
+            "10.100.0.0/16",
+            "11.0.0.0/8",
+            "192.168.0.0/24",
+            "192.168.1.255/32",
+            "192.168.0.0/16",
+            "192.168.2.0/24",
+        ):
+            probe = ipaddress.IPv4Network(probe)
+            self.assertEqual(
+                _overlaps_any(
+                    index, int(probe.network_address), int(probe.broadcast_address)
+                ),
+                any(probe.overlaps(n) for n in nets),
+                probe,
+            )
+
+
+class TestParseAddr(unittest.TestCase):
+    def test_same_result_as_ipaddress(self):
+        for addr in ("0.0.0.0", "10.1.20.255", "192.168.100.5", "255.255.255.255"):
+            self.assertIsNotNone(_ip4_to_int(addr))
+            self.assertEqual(_parse_addr(addr), ipaddress.IPv4Address(addr))
+
+    def test_same_error_as_ipaddress(self):
+        for addr in (
+            "010.1.2.3",
+            "10.1.2.03",
+            "10.1.2.00",
+            "256.1.2.3",
+            "10.1.2.300",
+            "10.1.2.1000",
+            "10.1.2",
+            "10.1.2.3.4",
+            "10.1..3",
+            "10.1.2.+3",
+        ):
+            self.assertIsNone(_ip4_to_int(addr))
+            with self.assertRaises(ipaddress.AddressValueError) as want:
+                ipaddress.IPv4Address(addr)
+            with self.assertRaises(ipaddress.AddressValueError) as got:
+                _parse_addr(addr)
+            self.assertEqual(str(got.exception), str(want.exception))
@@ -1,9 +1,14 @@
 from dataclasses import dataclass
+from functools import cached_property
 import unittest
 
 from .netacl import IPNetHostList
 from .netacl import raise_on_conflict
 
+_SEC_MODES = frozenset(("sys", "dh", "none", "krb5", "krb5i", "krb5p"))
+# Indexed by the boolean setting.
+_UB_SUFFIX = (" racktop:ub=off", " racktop:ub=on")
+
 
 @dataclass
 class NFSShare:
@@ -16,6 +21,19 @@ class NFSShare:
     ub: bool = True
     sec_mode: str = "sys"
 
+    def __post_init__(self):
+        # Settings are validated once, here, so that the properties below can
+        # simply hand them out. Checked in the order in which they appear in
+        # sharenfs, so that the first invalid one is the one reported.
+        if not self.sec_mode:
+            raise ValueError("Security mode cannot be empty")
+        if self.sec_mode not in _SEC_MODES:
+            raise ValueError(f"Invalid value for sec option: {self.sec_mode}")
+        if not isinstance(self.hideds, bool):
+            raise TypeError(f"Invalid type for hideds option: {self.hideds}")
+        if not isinstance(self.ub, bool):
+            raise TypeError(f"Invalid type for racktop:ub option: {self.ub}")
+
     @property
     def security_label(self):
         if self.sec_label:
@@ -24,135 +42,96 @@ class NFSShare:
 
     @property
     def security_mode(self):
-        if not self.sec_mode:
-            raise ValueError("Security mode cannot be empty")
-        if not self.sec_mode in {
-            "sys",
-            "dh",
-            "none",
-            "krb5",
-            "krb5i",
-            "krb5p",
-        }:
-            raise ValueError(f"Invalid value for sec option: {self.sec_mode}")
         return self.sec_mode
 
     @property
     def ub_setting(self):
-        if isinstance(self.ub, bool):
-            return self.ub
-        raise TypeError(f"Invalid type for racktop:ub option: {self.ub}")
+        return self.ub
 
     @property
     def hide_descendant_dataset(self):
-        if isinstance(self.hideds, bool):
-            if not self.hideds:
-                return "nohide"
-            else:
-                return None
-        raise TypeError(f"Invalid type for hideds option: {self.ub}")
-
-    def __str__(self):
-        parts = []
-        parts.append(sec_label) if (sec_label := self.security_label) else None
-        parts.append("anon=nobody")
-        parts.append(f"sec={self.security_mode}")
-        parts.append(hideds) if (hideds := self.hide_descendant_dataset) else None
-        if self.read_only_list() is not None:
-            parts.append(f"ro={self.fmt_read_only_list}")
-        if self.read_write_list() is not None:
-            parts.append(f"rw={self.fmt_read_write_list}")
-        if self.none_list() is not None:
-            parts.append(f"none={self.fmt_none_list}")
-        if self.root_list() is not None:
-            parts.append(f"root={self.fmt_root_list}")
-        return (
-            "sharenfs="
-            + ",".join(parts)
-            + " "
-            + f"racktop:ub={'on' if self.ub_setting else 'off'}"
-        )
-
-    @property
-    def fmt_read_write_list(self):
-        """Formats read/write list and converts into a string usable with zfs set command.
-
-        Returns:
-            str: Read/write list as a string.
-        """
-        return str(self.read_write_list())
-
-    @property
-    def fmt_read_only_list(self):
-        """Formats read-only list and converts into a string usable with zfs set command.
-
-        Returns:
-            str: Read-only list as a string.
-        """
-        return str(self.read_only_list())
+        if not self.hideds:
+            return "nohide"
+        return None
 
-    @property
-    def fmt_none_list(self):
-        """Formats other list and converts into a string usable with zfs set command.
+    def _sharenfs_value(self) -> str:
+        """Builds the value of the sharenfs property.
 
         Returns:
-            str: Other list as a string.
+            str: Comma-separated share options.
         """
-        return str(self.none_list())
-
-    @property
-    def fmt_root_list(self):
-        """Formats superuser list and converts into a string usable with zfs set command.
+        # Options which do not apply are left as None and skipped in the join.
+        ro = self.read_only_list
+        rw = self.read_write_list
+        none = self.none_list
+        root = self.root_list
+        parts = (
+            self.security_label,
+            "anon=nobody",
+            f"sec={self.sec_mode}",
+            self.hide_descendant_dataset,
+            f"ro={ro}" if ro is not None else None,
+            f"rw={rw}" if rw is not None else None,
+            f"none={none}" if none is not None else None,
+            f"root={root}" if root is not None else None,
+        )
+        return ",".join(filter(None, parts))
 
-        Returns:
-            str: Other list as a string.
-        """
-        return str(self.root_list())
+    def __str__(self):
+        return f"sharenfs={self._sharenfs_value()}" + _UB_SUFFIX[self.ub]
 
     def validate_access_lists(self):
         """
         Validates that the configuration is sane and will be accepted. Triggers
         an exception if the configuration is not appropriate.
         """
-        raise_on_conflict(self.read_only_list(), self.read_write_list())
+        raise_on_conflict(self.read_only_list, self.read_write_list)
 
+    @cached_property
     def read_only_list(self):
         """Coverts a given string to an read-only IPNetHostList.
 
         Returns:
-            IPNetHostList: Read-only list represented as native objects.
+            IPNetHostList: Read-only list represented as native objects, parsed
+            once and kept for the lifetime of this share.
         """
         if self.read_only:
             return IPNetHostList(self.read_only)
         return None
 
+    @cached_property
     def read_write_list(self):
         """Coverts a given string to an read/write IPNetHostList.
 
         Returns:
-            IPNetHostList: Read/write list represented as native objects.
+            IPNetHostList: Read/write list represented as native objects, parsed
+            once and kept for the lifetime of this share.
         """
         if self.read_write:
             return IPNetHostList(self.read_write)
         return None
 
+    @cached_property
     def none_list(self):
         """Coverts a given string to an none IPNetHostList.
 
         Returns:
-            IPNetHostList: None list represented as native objects.
+            IPNetHostList: None list represented as native objects, parsed
+            once and kept for the lifetime of this share.
         """
         if self.none:
             return IPNetHostList(self.none)
         return None
 
+    @cached_property
     def root_list(self):
         """Coverts a given string to a superuser IPNetHostList.
 
         Returns:
-            IPNetHostList: Superuser list represented as native objects.
+            IPNetHostList: Superuser list represented as native objects, parsed
+            once and kept for the lifetime of this share.
         """
-        if self.read_write:
+        if self.root:
             return IPNetHostList(self.root)
         return None
 
@@ -203,10 +182,35 @@ class TestNFSShare(unittest.TestCase):
             actual = str(case["params"])
             self.assertEqual(actual, case["want"])
 
-    def test_nfs_share_invalid_settings(self):
+    def test_nfs_share_root_list_follows_root(self):
         test_cases = (
             {
                 "params": NFSShare(
+                    read_only="",
+                    read_write="12.13.15.3",
+                    none="",
+                    root="",
+                ),
+                "want": "sharenfs=anon=nobody,sec=sys,nohide,rw=@12.13.15.3 racktop:ub=on",
+            },
+            {
+                "params": NFSShare(
+                    read_only="12.13.15.3",
+                    read_write="",
+                    none="",
+                    root="5.6.7.8",
+                ),
+                "want": "sharenfs=anon=nobody,sec=sys,nohide,ro=@12.13.15.3,root=@5.6.7.8 racktop:ub=on",
+            },
+        )
+        for case in test_cases:
+            actual = str(case["params"])
+            self.assertEqual(actual, case["want"])
+
+    def test_nfs_share_invalid_settings(self):
+        test_cases = (
+            {
+                "params": dict(
                     sec_label=True,
                     hideds="bogus",
                     read_only="10.0.0.0/8:1.2.3.4:10.1.0.0/16:12.13.14.0/24:foobar.alpha.com",
@@ -218,7 +222,7 @@ class TestNFSShare(unittest.TestCase):
                 "exception": TypeError,
             },
             {
-                "params": NFSShare(
+                "params": dict(
                     sec_label=True,
                     hideds=False,
                     read_only="10.0.0.0/8:1.2.3.4:10.1.0.0/16:12.13.14.0/24:foobar.alpha.com",
@@ -231,7 +235,7 @@ class TestNFSShare(unittest.TestCase):
                 "exception": ValueError,
             },
             {
-                "params": NFSShare(
+                "params": dict(
                     sec_label=False,
                     hideds=True,
                     sec_mode="bogus",
@@ -246,9 +250,11 @@ class TestNFSShare(unittest.TestCase):
         )
         for case in test_cases:
             print(case)
+            # Settings are validated as soon as the share is created.
             with self.assertRaises(case["exception"]) as e:
-                case["params"].validate_access_lists()
-                _ = str(case["params"])
+                share = NFSShare(**case["params"])
+                share.validate_access_lists()
+                _ = str(share)
             self.assertRegex(
                 e.exception.args[0], r"Invalid (type|value) for \S+ option: \S+"
             )
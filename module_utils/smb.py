@@ -1,9 +1,16 @@
 from dataclasses import dataclass
+from functools import cached_property
 import unittest
 
 from .netacl import IPNetHostList
 from .netacl import raise_on_conflict
 
+_CSC_VALUES = frozenset(("manual", "auto", "vdo", "disabled"))
+_ENCRYPT_VALUES = frozenset(("enabled", "disabled", "required"))
+# Indexed by the boolean setting.
+_ON_OFF = ("off", "on")
+_TF = ("false", "true")
+
 
 # 11 39:18 0.027879 [POST-4] 10.2.22.87> /usr/sbin/zfs set sharesmb=name=a,abe=true,csc=disabled,encrypt=required,ro=@10.255.4.0/24:@10.255.7.0/24,rw=@10.255.2.0/24:@10.255.5.0/24,none=@10.255.2.3:@10.255.2.4 p01/global/ahttps://10.2.22.87:8443/internal/v1/shell/run{"Command":"/usr/sbin/zfs","Args":"set sharesmb=name=a,abe=true,csc=disabled,encrypt=required,ro=@10.255.4.0/24:@10.255.7.0/24,rw=@10.255.2.0/24:@10.255.5.0/24,none=@10.255.2.3:@10.255.2.4 p01/global/a","UseShell":false,"IsQuery":false,"ActionId":"22ff7e60-91ec-4445-ab03-7ad519d6e382"}
 
@@ -22,133 +29,110 @@ class SMBShare:
 
     @property
     def property_pairs(self):
-        parts = []
-        parts.append(f"name={self.name}")
-        parts.append(f"abe={'true' if self.abe_setting else 'false'}")
-        parts.append(f"csc={self.csc_setting}")
-        parts.append(f"encrypt={self.encrypt_setting}")
-        if self.read_only_list() is not None:
-            parts.append(f"ro={self.fmt_read_only_list}")
-        if self.read_write_list() is not None:
-            parts.append(f"rw={self.fmt_read_write_list}")
-        if self.none_list() is not None:
-            parts.append(f"none={self.fmt_none_list}")
         return {
-            "sharesmb": ",".join(parts),
-            "racktop:ub": f"{'on' if self.ub_setting else 'off'}",
+            "sharesmb": self._sharesmb_value(),
+            "racktop:ub": _ON_OFF[self.ub],
         }
 
+    def __post_init__(self):
+        # Settings are validated once, here, so that the properties below can
+        # simply hand them out. Checked in the order in which they appear in
+        # sharesmb, so that the first invalid one is the one reported.
+        if not isinstance(self.abe, bool):
+            raise TypeError(f"Invalid type for abe option: {self.abe}")
+        if self.csc not in _CSC_VALUES:
+            raise ValueError(f"Invalid value for csc option: {self.csc}")
+        if self.encrypt not in _ENCRYPT_VALUES:
+            raise ValueError(f"Invalid value for encrypt option: {self.encrypt}")
+        if not isinstance(self.novss, bool):
+            raise TypeError(f"Invalid type for novss option: {self.novss}")
+        if not isinstance(self.ub, bool):
+            raise TypeError(f"Invalid type for racktop:ub option: {self.ub}")
+
     @property
     def csc_setting(self):
-        legal_values = ("manual", "auto", "vdo", "disabled")
-        if self.csc in legal_values:
-            return self.csc
-        raise ValueError(f"Invalid value for csc option: {self.csc}")
+        return self.csc
 
     @property
     def encrypt_setting(self):
-        legal_values = ("enabled", "disabled", "required")
-        if self.encrypt in legal_values:
-            return self.encrypt
-
-        raise ValueError(f"Invalid value for encrypt option: {self.encrypt}")
+        return self.encrypt
 
     @property
     def abe_setting(self):
-        if isinstance(self.abe, bool):
-            return self.abe
-        raise TypeError(f"Invalid type for abe option: {self.abe}")
+        return self.abe
 
     @property
     def ub_setting(self):
-        if isinstance(self.ub, bool):
-            return self.ub
-        raise TypeError(f"Invalid type for racktop:ub option: {self.ub}")
+        return self.ub
 
     @property
     def novss_setting(self):
-        if isinstance(self.novss, bool):
-            return self.novss
-        raise TypeError(f"Invalid type for novss option: {self.novss}")
-
-    def __str__(self):
-        parts = []
-        parts.append(f"name={self.name}")
-        parts.append(f"abe={'true' if self.abe_setting else 'false'}")
-        parts.append(f"csc={self.csc_setting}")
-        parts.append(f"encrypt={self.encrypt_setting}")
-        if self.novss_setting:  # Only include this property if it is enabled
-            parts.append("novss=true")
-        if self.read_only_list() is not None:
-            parts.append(f"ro={self.fmt_read_only_list}")
-        if self.read_write_list() is not None:
-            parts.append(f"rw={self.fmt_read_write_list}")
-        if self.none_list() is not None:
-            parts.append(f"none={self.fmt_none_list}")
-        return (
-            "sharesmb="
-            + ",".join(parts)
-            + " "
-            + f"racktop:ub={'on' if self.ub_setting else 'off'}"
-        )
+        return self.novss
 
-    @property
-    def fmt_read_write_list(self):
-        """Formats read/write list and converts into a string usable with zfs set command.
+    def _sharesmb_value(self) -> str:
+        """Builds the value of the sharesmb property, shared by property_pairs
+        and __str__ so that the two cannot drift apart.
 
         Returns:
-            str: Read/write list as a string.
+            str: Comma-separated share options.
         """
-        return str(self.read_write_list())
-
-    @property
-    def fmt_read_only_list(self):
-        """Formats read-only list and converts into a string usable with zfs set command.
-
-        Returns:
-            str: Read-only list as a string.
-        """
-        return str(self.read_only_list())
-
-    @property
-    def fmt_none_list(self):
-        """Formats other list and converts into a string usable with zfs set command.
+        # Options which do not apply are left as None and skipped in the join.
+        ro = self.read_only_list
+        rw = self.read_write_list
+        none = self.none_list
+        parts = (
+            f"name={self.name}",
+            f"abe={_TF[self.abe]}",
+            f"csc={self.csc}",
+            f"encrypt={self.encrypt}",
+            # Only include this property if it is enabled
+            "novss=true" if self.novss else None,
+            f"ro={ro}" if ro is not None else None,
+            f"rw={rw}" if rw is not None else None,
+            f"none={none}" if none is not None else None,
+        )
+        return ",".join(filter(None, parts))
 
-        Returns:
-            str: Other list as a string.
-        """
-        return str(self.none_list())
+    def __str__(self):
+        pairs = self.property_pairs
+        return f"sharesmb={pairs['sharesmb']} racktop:ub={pairs['racktop:ub']}"
 
     def validate_access_lists(self):
         """
         Validates that the configuration is sane and will be accepted. Triggers
         an exception if the configuration is not appropriate.
         """
-        raise_on_conflict(self.read_only_list(), self.read_write_list())
+        raise_on_conflict(self.read_only_list, self.read_write_list)
 
+    @cached_property
     def read_only_list(self):
         """Coverts a given string to an read-only IPNetHostList.
 
         Returns:
-            IPNetHostList: Read-only list represented as native objects.
+            IPNetHostList: Read-only list represented as native objects, parsed
+            once and kept for the lifetime of this share.
         """
         if self.read_only:
             return IPNetHostList(self.read_only)
 
+    @cached_property
     def read_write_list(self):
         """Coverts a given string to an read/write IPNetHostList.
 
         Returns:
-            IPNetHostList: Read/write list represented as native objects.
+            IPNetHostList: Read/write list represented as native objects, parsed
+            once and kept for the lifetime of this share.
         """
         if self.read_write:
             return IPNetHostList(self.read_write)
 
+    @cached_property
     def none_list(self):
         """Coverts a given string to an none IPNetHostList.
 
         Returns:
-            IPNetHostList: None list represented as native objects.
+            IPNetHostList: None list represented as native objects, parsed
+            once and kept for the lifetime of this share.
         """
         if self.none:
             return IPNetHostList(self.none)
@@ -230,10 +214,37 @@ class TestSMBShare(unittest.TestCase):
             actual = str(case["params"])
             self.assertEqual(actual, case["want"])
 
+    def test_smb_share_property_pairs_match_str(self):
+        share = SMBShare(
+            name="test",
+            abe=True,
+            csc="disabled",
+            encrypt="required",
+            read_only="10.0.0.0/8",
+            read_write="12.13.15.3",
+            none="",
+            novss=True,
+            ub=False,
+        )
+        self.assertEqual(
+            share.property_pairs,
+            {
+                "sharesmb": "name=test,abe=true,csc=disabled,encrypt=required,novss=true,ro=@10.0.0.0/8,rw=@12.13.15.3",
+                "racktop:ub": "off",
+            },
+        )
+        self.assertEqual(
+            str(share),
+            "sharesmb="
+            + share.property_pairs["sharesmb"]
+            + " racktop:ub="
+            + share.property_pairs["racktop:ub"],
+        )
+
     def test_smb_share_invalid_settings(self):
         test_cases = (
             {
-                "params": SMBShare(
+                "params": dict(
                     name="test",
                     abe=True,
                     csc="disabled",
@@ -246,7 +257,7 @@ class TestSMBShare(unittest.TestCase):
                 "exception": ValueError,
             },
             {
-                "params": SMBShare(
+                "params": dict(
                     name="test",
                     abe=True,
                     csc="bogus",
@@ -259,7 +270,7 @@ class TestSMBShare(unittest.TestCase):
                 "exception": ValueError,
             },
             {
-                "params": SMBShare(
+                "params": dict(
                     name="test",
                     abe=None,
                     csc="disabled",
@@ -273,9 +284,11 @@ class TestSMBShare(unittest.TestCase):
             },
         )
         for case in test_cases:
+            # Settings are validated as soon as the share is created.
             with self.assertRaises(case["exception"]) as e:
-                case["params"].validate_access_lists()
-                _ = str(case["params"])
+                share = SMBShare(**case["params"])
+                share.validate_access_lists()
+                _ = str(share)
             self.assertRegex(
                 e.exception.args[0], r"Invalid (type|value) for \S+ option: \S+"
             )
@@ -4,10 +4,6 @@ from dataclasses import dataclass
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.basic import env_fallback
 
-if True:
-    from ..module_utils import api_datasets
-    from ..module_utils import api
-
 from ansible.module_utils import api
 from ansible.module_utils import api_datasets
 
@@ -115,52 +111,53 @@ author:
 """
 
 
-def main():
-    # define available arguments/parameters a user can pass to the module
-    module_args = dict(
-        host=dict(type="str", required=False, default="localhost"),
-        port=dict(type="int", required=False, default=8443),
-        username=dict(type="str", required=False, default="root"),
-        password=dict(
-            type="str",
-            required=True,
-            no_log=True,
-            fallback=(env_fallback, ["ANSIBLE_BRICKSTOR_PASSWORD"]),
-        ),
-        ds_path=dict(type="str", required=True),
-        # The following applies to destroys
-        recursive=dict(type="bool", required=False, default=False),
-        state=dict(
-            type="str", required=False, default="present", choices=["absent", "present"]
-        ),
-        # The following dataset properties could be influenced by the user.
-        # FIXME: Should have choices here for storage_profile beyond custom and
-        # default.
-        storage_profile=dict(
-            type="str",
-            required=False,
-            choices=["general_filesystem", "custom_filesystem", "vmware_filesystem"],
-            default="general_filesystem",
-        ),
-        # ub=dict(type="bool", required=False, default=True),
-        aclmode=dict(
-            type="str",
-            default="passthrough",
-            choices=["discard" "groupmask", "passthrough", "restricted"],
-        ),
-        aclinherit=dict(
-            type="str",
-            default="passthrough",
-            choices=["discard" "groupmask", "passthrough", "restricted"],
-        ),
-        atime=dict(type="str", default="on", choices=["on", "off"]),
-        quota=dict(type="str", required=False, default=None),
-        refquota=dict(type="str", required=False, default=None),
-        reservation=dict(type="str", required=False, default=None),
-        refreservation=dict(type="str", required=False, default=None),
-        nbmand=dict(type="str", default="on", choices=["on", "off"]),
-    )
+# define available arguments/parameters a user can pass to the module
+_MODULE_ARGS = dict(
+    host=dict(type="str", required=False, default="localhost"),
+    port=dict(type="int", required=False, default=8443),
+    username=dict(type="str", required=False, default="root"),
+    password=dict(
+        type="str",
+        required=True,
+        no_log=True,
+        fallback=(env_fallback, ["ANSIBLE_BRICKSTOR_PASSWORD"]),
+    ),
+    ds_path=dict(type="str", required=True),
+    # The following applies to destroys
+    recursive=dict(type="bool", required=False, default=False),
+    state=dict(
+        type="str", required=False, default="present", choices=["absent", "present"]
+    ),
+    # The following dataset properties could be influenced by the user.
+    # FIXME: Should have choices here for storage_profile beyond custom and
+    # default.
+    storage_profile=dict(
+        type="str",
+        required=False,
+        choices=["general_filesystem", "custom_filesystem", "vmware_filesystem"],
+        default="general_filesystem",
+    ),
+    # ub=dict(type="bool", required=False, default=True),
+    aclmode=dict(
+        type="str",
+        default="passthrough",
+        choices=["discard", "groupmask", "passthrough", "restricted"],
+    ),
+    aclinherit=dict(
+        type="str",
+        default="passthrough",
+        choices=["discard", "noallow", "passthrough", "passthrough-x", "restricted"],
+    ),
+    atime=dict(type="str", default="on", choices=["on", "off"]),
+    quota=dict(type="str", required=False, default=None),
+    refquota=dict(type="str", required=False, default=None),
+    reservation=dict(type="str", required=False, default=None),
+    refreservation=dict(type="str", required=False, default=None),
+    nbmand=dict(type="str", default="on", choices=["on", "off"]),
+)
 
+
+def main():
     # seed the result dict in the object
     # we primarily care about changed and state
     # changed is if this module effectively modified the target
@@ -172,7 +169,7 @@ def main():
     # this includes instantiation, a couple of common attr would be the
     # args/params passed to the execution, as well as if the module
     # supports check mode
-    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
+    module = AnsibleModule(argument_spec=_MODULE_ARGS, supports_check_mode=True)
 
     # if the user is working with this module in only check mode we do not
     # want to make any changes to the environment, just return the current
@@ -1,18 +1,16 @@
 #!/usr/bin/env python3
 __metaclass__ = type
+from concurrent.futures import wait
 from dataclasses import dataclass
+import hashlib
+import json
+import os
+import time
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.basic import env_fallback
 
-if True:
-    from ..module_utils import api_datasets
-    from ..module_utils import api
-    from ..module_utils import netacl
-    from ..module_utils import smb
-
 from ansible.module_utils import api
 from ansible.module_utils import api_datasets
-from ansible.module_utils import smb
 
 
 # See https://sourcegraph.com/github.com/illumos/illumos-gate@master/-/blob/usr/src/uts/common/smbsrv/smb_sid.h for additional details.
@@ -121,6 +119,21 @@ options:
         it should be present.
         required: false
         type: str
+    no_cache:
+        description: Always check and apply the share configuration, even if
+        the same configuration was successfully applied less than cache_ttl
+        seconds ago. Set to false to skip applying again a configuration which
+        was recently applied.
+        required: false
+        type: bool
+        default: true
+    cache_ttl:
+        description: Number of seconds for which a successfully applied share
+        configuration is assumed to still be in place. Changes made outside of
+        this module within that time are not detected. Only used when no_cache
+        is false.
+        required: false
+        type: int
 
 # Specify this value according to your collection
 # in format of namespace.collection.doc_fragment_name
@@ -131,179 +144,309 @@ author:
     - Sam Zaydel (sz@racktopsystems.com)
 """
 
-from ansible.module_utils.basic import AnsibleModule
+
+# Messages for failed tasks, only formatted when a task actually fails.
+_FAIL_ACLS = "Failed to set ACLs on {path} | {err}"
+_FAIL_SMB_DISABLE = "Failed to disable SMB share on {path} | {err}"
+_FAIL_SMB_ENABLE = "Failed to enable SMB share on {path} | {err}"
+
+# Successfully applied share configurations are recorded here, one file per
+# dataset, holding a hash of the parameters which make up the configuration.
+_CACHE_DIR = os.path.join("~", ".ansible", "bsr_share_cache")
+_CACHE_KEY_PARAMS = (
+    "host",
+    "port",
+    "username",
+    "ds_path",
+    "proto",
+    "share_name",
+    "ro_access_list",
+    "rw_access_list",
+    "no_access_list",
+    "abe",
+    "csc",
+    "encrypt",
+    "novss",
+    "ub",
+    "owner_sid",
+    "owner_group_sid",
+    "filesystem_acls",
+)
+
+
+def _digest(values) -> str:
+    return hashlib.blake2b(
+        json.dumps(values, sort_keys=True, default=str).encode(), digest_size=16
+    ).hexdigest()
+
+
+def _cache_path(params) -> str:
+    """Path of the file recording which configuration was last applied to the
+    dataset given in params.
+
+    Args:
+        params (dict): Module parameters.
+
+    Returns:
+        str: Path of the cache file for this dataset.
+    """
+    key = _digest([params["host"], params["port"], params["ds_path"]])
+    return os.path.join(os.path.expanduser(_CACHE_DIR), key)
+
+
+def _config_key(params) -> str:
+    return _digest([params[k] for k in _CACHE_KEY_PARAMS])
+
+
+def _is_cached(path: str, config: str, ttl: int) -> bool:
+    try:
+        age = time.time() - os.stat(path).st_mtime
+        with open(path) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return age < ttl and isinstance(entry, dict) and entry.get("config") == config
+
+
+def _remember(path: str, ds_path: str, config: str):
+    # The cache is only an optimization, failing to write to it is not an
+    # error; the configuration is simply applied again next time.
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"ds_path": ds_path, "config": config}, f)
+    except OSError:
+        pass
+
+
+def _forget(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
 
 
 def share_is_absent(module, result):
     params = module.params
-    c = api.AnsibleBsrApiClient(
+    with api.AnsibleBsrApiClient(
         api.ApiCreds(u=params["username"], p=params["password"]),
-        host=module.params["host"],
-        port=module.params["port"],
-    )
+        host=params["host"],
+        port=params["port"],
+    ) as c:
+        ds_path = params["ds_path"]
+        ub = params["ub"]
+        proto = params["proto"]
+        if proto == "nfs":
+            pass  # Need to implement NFS
+
+        if proto == "smb":
+            # Whatever was applied before no longer holds once the share is
+            # disabled.
+            _forget(_cache_path(params))
+            ds = api_datasets.Dataset({"sharesmb": "off"})
+            resp = ds.configure_smb_share(ds_path, c)
+            if resp.error != "":
+                module.fail_json(
+                    _FAIL_SMB_DISABLE.format(path=ds_path, err=resp.error), **result
+                )
+            if resp.changed:
+                result["changed"] = True
+                details = result["details"]
+                details["smb"] = resp.details
+                details["racktop:ub"] = ub
+                result["comment"].append(f"disabled SMB share on {ds_path}")
+            else:
+                result["comment"].append(f"SMB share already disabled on {ds_path}")
+
 
+def share_is_present(module, result):
+    params = module.params
     ds_path = params["ds_path"]
-    ub = params["ub"]
     proto = params["proto"]
-    ds = api_datasets.Dataset()
-    if proto == "nfs":
-        pass  # Need to implement NFS
 
     if proto == "smb":
-        msg = f"Failed to disable SMB share on {ds_path}"
-        ds = api_datasets.Dataset({"sharesmb": "off"})
-        resp = ds.configure_smb_share(ds_path, c)
-        if resp.error != "":
-            msg += f" | {resp.error}"
-            module.fail_json(msg, **result)
-        if resp.changed:
-            result["changed"] = True
-            result["details"].update(
-                {
-                    "smb": resp.details,
-                    "racktop:ub": ub,
-                }
+        cache_path = _cache_path(params)
+        config = _config_key(params)
+        if not params["no_cache"] and _is_cached(
+            cache_path, config, params["cache_ttl"]
+        ):
+            result["comment"].append(
+                f"ACL and SMB share on {ds_path} already matched desired state (cached)"
             )
-            result["comment"].append(f"disabled SMB share on {ds_path}")
+            return
+        # The record is only written again once everything was applied, so
+        # that a task which fails, or is interrupted, part way through is
+        # never skipped afterwards.
+        _forget(cache_path)
 
-
-def share_is_present(module, result):
-    params = module.params
-    c = api.AnsibleBsrApiClient(
+    with api.AnsibleBsrApiClient(
         api.ApiCreds(u=params["username"], p=params["password"]),
-        host=module.params["host"],
-        port=module.params["port"],
-    )
-
-    ds_path = params["ds_path"]
-    share_name = None
-    if params["share_name"] == "":
-        share_name = ds_path.split("/")[-1]
-    else:
+        host=params["host"],
+        port=params["port"],
+    ) as c:
         share_name = params["share_name"]
-    ro_access_list = params["ro_access_list"]
-    rw_access_list = params["rw_access_list"]
-    no_access_list = params["no_access_list"]
-    abe = params["abe"]
-    csc = params["csc"]
-    encrypt = params["encrypt"]
-    ub = params["ub"]
-    novss = params["novss"]
-    proto = params["proto"]
-    owner_sid = params["owner_sid"]
-    owner_group_sid = params["owner_group_sid"]
-    filesystem_acls = params["filesystem_acls"]
-    ds = api_datasets.Dataset()
-    # We first want to make sure that ACLs on the filesystem are setup and
-    # if this fails, then we should stop processing this task.
-    resp = ds.set_permissions(ds_path, filesystem_acls, owner_sid, owner_group_sid, c)
-    if resp.error != "":
-        msg = f"Failed to set ACLs on {ds_path} | {resp.error}"
-        module.fail_json(msg, **result)
-
-    if resp.changed:
-        result["changed"] = True
-        result["comment"].append("ACL on the filesystem was modified")
-        result["details"].update(
-            {
-                "filesystem_acl": resp.details,
-            }
-        )
-    else:  # No change was necessary
-        result["comment"].append("ACL on the filesystem already matched desired state")
-
-    if proto == "nfs":
-        pass  # Need to implement NFS
-
-    if proto == "smb":
-        msg = f"Failed to enable SMB share on {ds_path}"
-        # We have to support NFS and SMB here. For the moment it is only SMB.
-        share = smb.SMBShare(
-            share_name,
-            csc,
-            encrypt,
-            ro_access_list,
-            rw_access_list,
-            no_access_list,
-            abe,
-            novss,
-            ub,
-        )
-        try:
-            share.validate_access_lists()
-            ds = api_datasets.Dataset(share.property_pairs)
-            # resp = ds.configure_smb_share(ds_path, c, **share.property_pairs)
-            resp = ds.configure_smb_share(ds_path, c)
+        if share_name == "":
+            share_name = ds_path.split("/")[-1]
+        ro_access_list = params["ro_access_list"]
+        rw_access_list = params["rw_access_list"]
+        no_access_list = params["no_access_list"]
+        abe = params["abe"]
+        csc = params["csc"]
+        encrypt = params["encrypt"]
+        ub = params["ub"]
+        novss = params["novss"]
+        owner_sid = params["owner_sid"]
+        owner_group_sid = params["owner_group_sid"]
+        filesystem_acls = params["filesystem_acls"]
+        props_lookup = None
+        if not (filesystem_acls or owner_sid or owner_group_sid):
+            # Not giving an ACL or owners means they are managed elsewhere.
+            result["comment"].append(
+                "No filesystem ACL or owners given, filesystem ACL was left as is"
+            )
+        else:
+            if not filesystem_acls:
+                result["comment"].append(
+                    "No filesystem ACL given, only filesystem owners were applied"
+                )
+            ds = api_datasets.Dataset()
+            # Share properties are only changed once ACLs are in place, but
+            # they can already be looked up while ACLs are applied. ACLs do
+            # not affect them, so the lookup warms the properties cache of the
+            # client for configure_smb_share below.
+            if proto == "smb":
+                # Login first, otherwise the lookup and set_permissions would
+                # each login on their own.
+                c.auth_if_required()
+                props_lookup = c.executor.submit(c.get_dataset_properties, ds_path)
+            # We first want to make sure that ACLs on the filesystem are setup
+            # and if this fails, then we should stop processing this task.
+            resp = ds.set_permissions(
+                ds_path, filesystem_acls, owner_sid, owner_group_sid, c
+            )
             if resp.error != "":
-                msg += f" | {resp.error}"
-                module.fail_json(msg, **result)
+                module.fail_json(
+                    _FAIL_ACLS.format(path=ds_path, err=resp.error), **result
+                )
+
             if resp.changed:
                 result["changed"] = True
-                result["details"].update({"smb": resp.details})
-                result["comment"].append(f"configured SMB share on {ds_path}")
-
-        except netacl.InvalidAddressSpecification as e:
-            msg += f" | {e.args[0]}"
-            module.fail_json(msg, **result)
-        except ValueError as e:
-            msg += f" | {e.args[0]}"
-            module.fail_json(msg, **result)
+                result["comment"].append("ACL on the filesystem was modified")
+                result["details"]["filesystem_acl"] = resp.details
+            else:  # No change was necessary
+                result["comment"].append(
+                    "ACL on the filesystem already matched desired state"
+                )
+
+        if proto == "nfs":
+            pass  # Need to implement NFS
+
+        if proto == "smb":
+            # Only needed to configure SMB shares, so not imported when
+            # disabling a share.
+            from ansible.module_utils import netacl
+            from ansible.module_utils import smb
+
+            # We have to support NFS and SMB here. For the moment it is only
+            # SMB.
+            try:
+                # Settings are validated when the share is created.
+                share = smb.SMBShare(
+                    share_name,
+                    csc,
+                    encrypt,
+                    ro_access_list,
+                    rw_access_list,
+                    no_access_list,
+                    abe,
+                    novss,
+                    ub,
+                )
+                share.validate_access_lists()
+                ds = api_datasets.Dataset(share.property_pairs)
+                # Only wait for the lookup to finish. Its failures are not
+                # handled here, configure_smb_share runs into them again and
+                # reports them.
+                if props_lookup is not None:
+                    wait([props_lookup])
+                # resp = ds.configure_smb_share(ds_path, c, **share.property_pairs)
+                resp = ds.configure_smb_share(ds_path, c)
+                if resp.error != "":
+                    module.fail_json(
+                        _FAIL_SMB_ENABLE.format(path=ds_path, err=resp.error), **result
+                    )
+                if resp.changed:
+                    result["changed"] = True
+                    result["details"]["smb"] = resp.details
+                    result["comment"].append(f"configured SMB share on {ds_path}")
+
+            except (netacl.InvalidAddressSpecification, ValueError) as e:
+                module.fail_json(
+                    _FAIL_SMB_ENABLE.format(path=ds_path, err=e.args[0]), **result
+                )
+
+            if not params["no_cache"]:
+                _remember(cache_path, ds_path, config)
+
+
+# define available arguments/parameters a user can pass to the module
+_MODULE_ARGS = dict(
+    host=dict(type="str", required=False, default="localhost"),
+    port=dict(type="int", required=False, default=8443),
+    username=dict(type="str", required=False, default="root"),
+    password=dict(
+        type="str",
+        required=True,
+        no_log=True,
+        fallback=(env_fallback, ["ANSIBLE_BRICKSTOR_PASSWORD"]),
+    ),
+    ds_path=dict(type="str", required=True),
+    filesystem_acls=dict(type="list", required=False, default=[]),
+    owner_sid=dict(type="str", required=False, default=""),
+    owner_group_sid=dict(type="str", required=False, default=""),
+    proto=dict(type="str", required=True, choices=["nfs", "smb"]),
+    share_name=dict(type="str", required=False, default=""),
+    rw_access_list=dict(type="list", required=False, default=""),
+    ro_access_list=dict(type="list", required=False, default=""),
+    no_access_list=dict(type="list", required=False, default=""),
+    abe=dict(type="bool", required=False, default=False),
+    csc=dict(
+        type="str",
+        required=False,
+        default="disabled",
+        choices=["auto", "disabled", "manual", "vdo"],
+    ),
+    encrypt=dict(
+        type="str",
+        required=False,
+        default="required",
+        choices=["disabled", "enabled", "required"],
+    ),
+    novss=dict(type="bool", required=False, default=False),
+    ub=dict(type="bool", required=False, default=True),
+    state=dict(
+        type="str", required=False, default="present", choices=["absent", "present"]
+    ),
+    no_cache=dict(type="bool", required=False, default=True),
+    cache_ttl=dict(type="int", required=False, default=600),
+    # recursive=dict(type="bool", required=False, default=False),
+)
+
+_REQUIRED_IF = [
+    (
+        "state",
+        "present",
+        ("ds_path", "filesystem_acls", "owner_sid", "owner_group_sid", "proto"),
+    ),
+    ("state", "absent", ("ds_path",)),
+]
 
 
 def run_module():
-    # define available arguments/parameters a user can pass to the module
-    module_args = dict(
-        host=dict(type="str", required=False, default="localhost"),
-        port=dict(type="int", required=False, default=8443),
-        username=dict(type="str", required=False, default="root"),
-        password=dict(
-            type="str",
-            required=True,
-            no_log=True,
-            fallback=(env_fallback, ["ANSIBLE_BRICKSTOR_PASSWORD"]),
-        ),
-        ds_path=dict(type="str", required=True),
-        filesystem_acls=dict(type="list", required=False, default=[]),
-        owner_sid=dict(type="str", required=False, default=""),
-        owner_group_sid=dict(type="str", required=False, default=""),
-        proto=dict(type="str", required=True, choices=["nfs", "smb"]),
-        share_name=dict(type="str", required=False, default=""),
-        rw_access_list=dict(type="list", required=False, default=""),
-        ro_access_list=dict(type="list", required=False, default=""),
-        no_access_list=dict(type="list", required=False, default=""),
-        abe=dict(type="bool", required=False, default=False),
-        csc=dict(
-            type="str",
-            required=False,
-            default="disabled",
-            choices=["auto", "disabled", "manual", "vdo"],
-        ),
-        encrypt=dict(
-            type="str",
-            required=False,
-            default="required",
-            choices=["disabled", "enabled", "required"],
-        ),
-        novss=dict(type="bool", required=False, default=False),
-        ub=dict(type="bool", required=False, default=True),
-        state=dict(
-            type="str", required=False, default="present", choices=["absent", "present"]
-        ),
-        # recursive=dict(type="bool", required=False, default=False),
-    )
-
-    result = dict(changed=False, comment="")
+    result = dict(changed=False, comment=[], details=dict())
 
-    required_if = [
-        (
-            "state",
-            "present",
-            ("ds_path", "filesystem_acls", "owner_sid", "owner_group_sid", "proto"),
-        ),
-        ("state", "absent", ("ds_path",)),
-    ]
     module = AnsibleModule(
-        argument_spec=module_args, required_if=required_if, supports_check_mode=True
+        argument_spec=_MODULE_ARGS, required_if=_REQUIRED_IF, supports_check_mode=True
     )
 
     # if the user is working with this module in only check mode we do not
@@ -312,13 +455,7 @@ def run_module():
     if module.check_mode:
         module.exit_json(**result)
 
-    state = module.params["state"]
-
-    result["changed"] = False
-    result["comment"] = []
-    result["details"] = dict()
-
-    if state == "present":
+    if module.params["state"] == "present":
         share_is_present(module, result)
     else:  # share is absent
         share_is_absent(module, result)